@@ -0,0 +1,220 @@
+"""Scaling benchmarks for the geometry and maths hot paths
+
+    python -m pytest -s benchmarks/bench_scaling.py
+
+Every case runs at 10^2 up to 10^6 elements (capped per case, the graph
+cases grow superlinearly) on seeded inputs. The best of REPEAT runs and
+the peak traced memory are printed and compared with
+benchmarks/baseline.json, which was recorded on another machine, so raw
+seconds are never compared:
+
+- time is divided by a fixed interpreter workload timed just before each
+  repeat, since the speed of a shared machine drifts during a session,
+  and a case fails when the best ratio is more than BENCH_THRESHOLD
+  (default 1.5) times the baseline's,
+- the scaling exponent from the size ten times smaller, log10 of the
+  ratio of the two times, may exceed the baseline's by EXPONENT_SLACK,
+- the peak memory may be BENCH_MEMORY_THRESHOLD (default 1.25) times the
+  baseline's.
+
+Timings are only compared when they took at least MIN_SECONDS, below that
+the noise dominates, and peaks only from MIN_PEAK bytes.
+
+BENCH_UPDATE=1 rewrites the baseline with the new results,
+BENCH_MAX_SIZE=n lowers or raises every cap.
+"""
+
+import json
+import math
+import os
+import time
+import tracemalloc
+from functools import lru_cache
+from random import Random
+
+import pytest
+
+from terrain.euclid import Matrix4, Vector3
+from terrain.geometry import Graph, Halfedge, Vertex, ccw
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', '1.5'))
+MEMORY_THRESHOLD = float(os.environ.get('BENCH_MEMORY_THRESHOLD', '1.25'))
+EXPONENT_SLACK = 0.2
+MAX_SIZE = int(os.environ.get('BENCH_MAX_SIZE', '0'))
+UPDATE = bool(os.environ.get('BENCH_UPDATE'))
+REPEAT = 3
+MIN_SECONDS = 0.005
+MIN_PEAK = 64 * 1024
+SIZES = [10 ** k for k in range(2, 7)]
+
+def _points(n, seed=0):
+    rand = Random(seed)
+    return [Vertex(rand.uniform(-1, 1), rand.uniform(-1, 1), rand.random())
+            for _ in range(n)]
+
+@lru_cache(maxsize=None)
+def _graph(n):
+    return Graph([p[:] for p in _points(n)])
+
+# each case is (setup(n) -> data, run(data), largest size)
+def _ccw_setup(n):
+    return _points(n + 2)
+
+def _ccw_run(points):
+    for i in range(len(points) - 2):
+        ccw(points[i], points[i + 1], points[i + 2])
+
+def _add_halfedge_setup(n):
+    # independent triangles, every vertex ends up with two halfedges
+    points = _points(n - n % 3)
+    return [points[i:i + 3] for i in range(0, len(points), 3)]
+
+def _add_halfedge_run(triangles):
+    for tri in triangles:
+        for i in range(-1, 2):
+            u, v = tri[i], tri[i + 1]
+            u_he, v_he = Halfedge(u), Halfedge(v)
+            u_he.twin, v_he.twin = v_he, u_he
+            u.add_halfedge(u_he)
+            v.add_halfedge(v_he)
+
+def _add_vertex_setup(n):
+    graph = Graph()
+    graph.add_edge(graph.vertices[0], graph.vertices[2])
+    return graph, _points(n)
+
+def _add_vertex_run(data):
+    graph, points = data
+    for p in points:
+        graph.add_vertex(p)
+
+def _gl_vertices_run(graph):
+    graph.gl_vertices()
+
+def _matrix_setup(n):
+    rand = Random(0)
+    return [Matrix4.new_rotatez(rand.random()).translate(1, 2, 3)
+            for _ in range(n)]
+
+def _matrix_mul_run(matrices):
+    acc = Matrix4()
+    for m in matrices:
+        acc.mul_into(m, acc)
+
+def _matrix_inverse_run(matrices):
+    out = Matrix4()
+    for m in matrices:
+        m.inverse_into(out)
+
+def _vector_setup(n):
+    rand = Random(0)
+    return [Vector3(rand.random(), rand.random(), rand.random())
+            for _ in range(n)]
+
+def _vector_run(vectors):
+    acc = Vector3()
+    for v in vectors:
+        acc += (v * 2.0 - acc).cross(v).normalized()
+
+CASES = {
+    'ccw': (_ccw_setup, _ccw_run, 10 ** 6),
+    'Vertex.add_halfedge': (_add_halfedge_setup, _add_halfedge_run, 10 ** 5),
+    'Graph.add_vertex': (_add_vertex_setup, _add_vertex_run, 10 ** 4),
+    'Graph.gl_vertices': (_graph, _gl_vertices_run, 10 ** 4),
+    'Matrix4.mul_into': (_matrix_setup, _matrix_mul_run, 10 ** 5),
+    'Matrix4.inverse_into': (_matrix_setup, _matrix_inverse_run, 10 ** 5),
+    'Vector3 arithmetic': (_vector_setup, _vector_run, 10 ** 6),
+}
+
+def _calibration_run():
+    # plain interpreter work that doesn't depend on the code under test
+    acc = 0.0
+    for i in range(200000):
+        acc += (i % 7) * 0.5 - acc * 1e-3
+    return acc
+
+def _params():
+    for name, (_, _, largest) in sorted(CASES.items()):
+        cap = MAX_SIZE or largest
+        for n in SIZES:
+            if n <= cap:
+                yield name, n
+
+def _measure(name, n):
+    setup, run, _ = CASES[name]
+    best = relative = None
+    for _ in range(REPEAT):
+        data = setup(n)
+        start = time.perf_counter()
+        _calibration_run()
+        middle = time.perf_counter()
+        run(data)
+        elapsed = time.perf_counter() - middle
+        if best is None or elapsed < best:
+            best = elapsed
+        ratio = elapsed / (middle - start)
+        if relative is None or ratio < relative:
+            relative = ratio
+
+    data = setup(n)
+    tracemalloc.start()
+    run(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, relative, peak
+
+@pytest.fixture(scope='module')
+def baseline():
+    try:
+        with open(BASELINE) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = dict()
+    # the seconds of this run, for the exponents
+    seconds = dict()
+    results = dict()
+    yield stored, seconds, results
+    if UPDATE and results:
+        stored.update(results)
+        with open(BASELINE, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+@pytest.mark.parametrize('name,n', list(_params()))
+def test_scaling(baseline, name, n):
+    stored, measured, results = baseline
+    key = '%s/%d' % (name, n)
+    seconds, relative, peak = _measure(name, n)
+    measured[key] = seconds
+    smaller = measured.get('%s/%d' % (name, n // 10))
+    exponent = None
+    if smaller is not None and min(seconds, smaller) >= MIN_SECONDS:
+        exponent = math.log10(seconds / smaller)
+    result = results[key] = {
+        'relative': relative, 'exponent': exponent, 'peak': peak}
+
+    expected = stored.get(key)
+    if not isinstance(expected, dict):
+        # missing, or a raw timing from before the ratios
+        expected = None
+    print("\n%-28s %10.5f s %10.1f ns/elem %10.1f KiB peak %9.3g units%s%s"
+          % (key, seconds, seconds / n * 1e9, peak / 1024.,
+             result['relative'],
+             '' if exponent is None else ' n^%.2f' % exponent,
+             '' if expected is None else '  (baseline %.3g units)'
+             % expected['relative']))
+    if UPDATE or expected is None:
+        return
+    if seconds >= MIN_SECONDS:
+        assert result['relative'] <= expected['relative'] * THRESHOLD, \
+            '%s regressed: %.3g units against a baseline of %.3g' % (
+                key, result['relative'], expected['relative'])
+    if exponent is not None and expected['exponent'] is not None:
+        assert exponent <= expected['exponent'] + EXPONENT_SLACK, \
+            '%s scales as n^%.2f against n^%.2f in the baseline' % (
+                key, exponent, expected['exponent'])
+    if expected['peak'] >= MIN_PEAK:
+        assert peak <= expected['peak'] * MEMORY_THRESHOLD, \
+            '%s peaks at %d bytes against %d in the baseline' % (
+                key, peak, expected['peak'])
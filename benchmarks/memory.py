@@ -0,0 +1,36 @@
+"""Per-instance memory of euclid points, with and without __slots__
+
+    python -m benchmarks.memory [count]
+"""
+
+import sys
+import tracemalloc
+
+from terrain.euclid import Point3
+
+class DictPoint3(Point3):
+    # what every Point3 looked like while the metaclass was ignored
+    pass
+
+def measure(cls, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # share one coordinate object so only the instances are counted
+    points = [cls(0.5, 0.5, 0.5) for i in range(count)]
+    for p in points:
+        # a __dict__ is only materialized once it is asked for
+        getattr(p, '__dict__', None)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # the list itself holds one pointer per point
+    return (after - before) / count - 8
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 1000000
+    print("%d points" % count)
+    rows = [('Point3 with __dict__', DictPoint3), ('Point3', Point3)]
+    for name, cls in rows:
+        print("%-24s %8.1f bytes/instance" % (name, measure(cls, count)))
+
+if __name__ == '__main__':
+    main(sys.argv)
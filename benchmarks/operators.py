@@ -0,0 +1,54 @@
+"""Nanoseconds per operation for the euclid Vector3/Point3 operators
+
+    python -m benchmarks.operators [number]
+"""
+
+import sys
+import timeit
+
+SETUP = '''
+from terrain.euclid import Vector3, Point3, Matrix4
+from terrain.geometry import ccw, Vertex
+u = Vector3(1.5, -2.0, 0.25)
+v = Vector3(0.5, 3.0, -1.0)
+p = Point3(0.1, 0.2, 0.3)
+q = Point3(1.0, 2.0, 3.0)
+a = Vertex(0.0, 0.0, 0.1)
+b = Vertex(1.0, 0.0, 0.2)
+c = Vertex(0.0, 1.0, 0.3)
+m = Matrix4.new_rotatez(0.3)
+'''
+
+CASES = [
+    ('Vector3 + Vector3', 'u + v'),
+    ('Point3 + Vector3', 'p + v'),
+    ('Vector3 - Vector3', 'u - v'),
+    ('Point3 - Point3', 'p - q'),
+    ('Vector3 += Vector3', 'u += v'),
+    ('Vector3 * scalar', 'u * 2.0'),
+    ('scalar * Vector3', '2.0 * u'),
+    ('Vector3 * Vector3', 'u * v'),
+    ('Vector3 / scalar', 'u / 2.0'),
+    ('-Vector3', '-u'),
+    ('Vector3.dot', 'u.dot(v)'),
+    ('Vector3.cross', 'u.cross(v)'),
+    ('Vector3.magnitude', 'u.magnitude()'),
+    ('Vector3.normalized', 'u.normalized()'),
+    ('Vector3 == Vector3', 'u == v'),
+    ('Vector3[i]', 'u[1]'),
+    ('iter(Vector3)', '[*u]'),
+    ('swizzle .xy', 'u.xy'),
+    ('missing dunder', "getattr(u, '__array__', None)"),
+    ('Matrix4 * Point3', 'm * p'),
+    ('ccw', 'ccw(a, b, c)'),
+    ('face normal', '(a - c).cross(b - a).normalize()'),
+]
+
+def main(argv):
+    number = int(argv[1]) if len(argv) > 1 else 200000
+    for name, stmt in CASES:
+        best = min(timeit.repeat(stmt, SETUP, number=number, repeat=5))
+        print("%-22s %8.1f ns/op" % (name, best / number * 1e9))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,295 @@
+"""Randomized stress runs of the triangulation
+
+    python -m benchmarks.stress [--sizes 1000,10000] [--dists uniform,grid]
+                                [--engines input,brio,delaunay] [--seed 0]
+                                [--timeout 600] [--memory]
+
+Inserts n seeded points of every distribution into the demo square, one
+at a time, with every engine:
+
+- input: Graph.add_vertex in the order the points were generated,
+- brio: Graph.add_vertex in brio_order,
+- delaunay: the insertions and Lawson flips of delaunay.Triangulation.
+
+Every insert is timed on its own. The graph engines check the rings of
+each new vertex with validate.check_sample and the whole graph with
+validate.check at every power of ten and at the end. The delaunay engine
+checks there that every triangle is counter-clockwise and every edge
+locally Delaunay, and at the end builds the Graph and validates it too.
+The work column is walk steps per insert, or flips per insert for
+delaunay.
+
+A run stops at the first invariant violation, and is killed when it takes
+longer than --timeout seconds, which is how a walk that never ends shows
+up. --memory traces allocations too, which makes the inserts several times
+slower. Every run gets its own process, so a hang or a huge graph doesn't
+affect the next one. The exit status is 1 if any run failed.
+
+New operations go into ENGINES, new inputs into DISTRIBUTIONS.
+"""
+
+import argparse
+import math
+import multiprocessing
+import sys
+import time
+import tracemalloc
+from random import Random
+
+# validate imports it on first use, this keeps that out of the traces
+import numpy
+
+from terrain import validate
+from terrain.delaunay import Triangulation, incircle
+from terrain.geometry import Graph, Vertex, brio_order, ccw
+
+# everything stays well inside the (-1, 1) square the graph starts with
+EXTENT = 0.95
+
+def _uniform(n, rand):
+    return [(rand.uniform(-EXTENT, EXTENT), rand.uniform(-EXTENT, EXTENT))
+            for _ in range(n)]
+
+def _clustered(n, rand):
+    # gaussian blobs, dense cores next to empty space
+    centers = [(rand.uniform(-0.7, 0.7), rand.uniform(-0.7, 0.7))
+               for _ in range(max(1, int(math.sqrt(n) / 4)))]
+    points = []
+    while len(points) < n:
+        cx, cy = rand.choice(centers)
+        x, y = rand.gauss(cx, 0.02), rand.gauss(cy, 0.02)
+        if abs(x) < EXTENT and abs(y) < EXTENT:
+            points.append((x, y))
+    return points
+
+def _grid(n, rand):
+    # exact rows and columns, many points land on existing edges
+    k = max(2, int(math.ceil(math.sqrt(n))))
+    step = 2 * EXTENT / (k - 1)
+    points = [(-EXTENT + step * (i % k), -EXTENT + step * (i // k))
+              for i in range(k * k)][:n]
+    rand.shuffle(points)
+    return points
+
+def _near_collinear(n, rand):
+    # a few long lines, each point off its line by at most 1e-9
+    lines = [(rand.uniform(-0.8, 0.8), rand.uniform(-0.3, 0.3))
+             for _ in range(max(1, int(math.log(n + 1))))]
+    points = []
+    for _ in range(n):
+        offset, slope = rand.choice(lines)
+        x = rand.uniform(-0.8, 0.8)
+        points.append((x, offset + slope * x + rand.uniform(-1e-9, 1e-9)))
+    return points
+
+DISTRIBUTIONS = {
+    'uniform': _uniform,
+    'clustered': _clustered,
+    'grid': _grid,
+    'near-collinear': _near_collinear,
+}
+
+class _Walking:
+    # Graph.add_vertex into the demo square, in the order given by order
+    def __init__(self, vertices, seed, order):
+        self.graph = Graph()
+        self.graph.add_edge(self.graph.vertices[0], self.graph.vertices[2])
+        self.steps = order(vertices, seed)
+
+    def insert(self, v):
+        self.graph.add_vertex(v)
+
+    def check_step(self, v):
+        validate.check_sample(self.graph, [v])
+
+    def check(self, done):
+        validate.check(self.graph)
+
+    def work(self):
+        return self.graph.walk_steps
+
+class _Delaunay:
+    # the steps of delaunay.delaunay, so each insertion is timed with its
+    # flips; the square corners are the hull
+    def __init__(self, vertices, seed):
+        corners = [Vertex(1, 1, 0), Vertex(-1, 1, 0),
+                   Vertex(-1, -1, 0), Vertex(1, -1, 0)]
+        self.vertices = corners + vertices
+        self.t = Triangulation(self.vertices, Random(seed))
+        self.t.triangulate_hull([0, 1, 2, 3])
+        interior = list(range(4, len(self.vertices)))
+        self.t.distribute(interior)
+        self.t.rand.shuffle(interior)
+        self.steps = interior
+        # the hull was flipped to Delaunay already, count from here
+        self.t.flips = 0
+
+    def insert(self, i):
+        self.t.insert(i)
+
+    def check_step(self, i):
+        pass
+
+    def check(self, done):
+        pts = self.vertices
+        triangles = self.t.triangles()
+        if len(triangles) != 2 * (done + 4) - 4 - 2:
+            raise ValueError('%d triangles for %d points'
+                             % (len(triangles), done + 4))
+        owner = self.t.owner
+        for a, b, c in triangles:
+            if ccw(pts[a], pts[b], pts[c]) <= 0:
+                raise ValueError('triangle %r is not counter-clockwise'
+                                 % ((a, b, c),))
+            for u, w, p in ((a, b, c), (b, c, a), (c, a, b)):
+                o = owner.get((w, u))
+                if o is not None and incircle(
+                        pts[u], pts[w], pts[p], pts[self.t.apex(o, w, u)]) > 0:
+                    raise ValueError('edge %r is not locally Delaunay'
+                                     % ((u, w),))
+        if done == len(self.steps):
+            validate.check(Graph.from_triangles(pts, triangles))
+
+    def work(self):
+        return self.t.flips
+
+ENGINES = {
+    'input': lambda vertices, seed: _Walking(
+        vertices, seed, lambda vertices, seed: vertices),
+    'brio': lambda vertices, seed: _Walking(vertices, seed, brio_order),
+    'delaunay': _Delaunay,
+}
+
+def _checkpoints(n):
+    marks = set(10 ** k for k in range(1, int(math.log10(n)) + 1))
+    marks.add(n)
+    return marks
+
+def _stress(conn, dist, engine, n, seed, memory):
+    # runs in the child, sends a row per checkpoint and a final status
+    rand = Random(seed)
+    vertices = [Vertex(x, y, rand.random())
+                for x, y in DISTRIBUTIONS[dist](n, rand)]
+    engine = ENGINES[engine](vertices, seed)
+    marks = _checkpoints(n)
+    if memory:
+        tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0] if memory else 0
+
+    total = worst = 0.0
+    done = 0
+    last_time = last_steps = 0
+    perf_counter = time.perf_counter
+    insert = engine.insert
+    try:
+        for v in engine.steps:
+            start = perf_counter()
+            insert(v)
+            elapsed = perf_counter() - start
+            total += elapsed
+            if elapsed > worst:
+                worst = elapsed
+            done += 1
+            engine.check_step(v)
+            if done in marks:
+                engine.check(done)
+                used = tracemalloc.get_traced_memory()[0] - base \
+                    if memory else None
+                chunk = done - last_steps
+                conn.send(('row', done, total, (total - last_time) / chunk,
+                           worst, engine.work() / done, used))
+                last_time = total
+                last_steps = done
+        conn.send(('ok', done))
+    except ValueError as e:
+        conn.send(('invalid', done, str(e)))
+
+def run(dist, engine, n, seed=0, timeout=None, memory=False, out=print):
+    """Stress one distribution and engine, return (status, inserts, rows)
+
+    status is 'ok', 'invalid', 'timeout' or 'crashed'. Each row is
+    (inserted, seconds, seconds per insert since the last row, slowest
+    insert, walk steps or flips per insert, traced bytes or None) and is
+    passed to out as soon as it arrives.
+    """
+    context = multiprocessing.get_context('spawn')
+    conn, child = context.Pipe(duplex=False)
+    process = context.Process(target=_stress,
+                              args=(child, dist, engine, n, seed, memory),
+                              daemon=True)
+    process.start()
+    child.close()
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    rows = []
+    done = 0
+    status = 'crashed'
+    while True:
+        wait = None if deadline is None else deadline - time.monotonic()
+        if wait is not None and wait <= 0 or not conn.poll(wait):
+            status = 'timeout'
+            break
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message[0] == 'row':
+            rows.append(message[1:])
+            done = message[1]
+            out(dist, engine, n, message[1:])
+            continue
+        status, done = message[0], message[1]
+        if status == 'invalid':
+            out(dist, engine, n, message[2])
+        break
+
+    if process.is_alive():
+        process.terminate()
+    process.join()
+    conn.close()
+    return status, done, rows
+
+def _print_row(dist, engine, n, row):
+    if isinstance(row, str):
+        print("%-16s %-8s %9d  %s" % (dist, engine, n, row))
+        return
+    inserted, total, chunk, worst, work, used = row
+    print("%-16s %-8s %9d %9d %9.3f %10.1f %10.1f %9.1f %10s" % (
+        dist, engine, n, inserted, total, chunk * 1e6, worst * 1e6, work,
+        '' if used is None else '%.1f' % (used / inserted)))
+    sys.stdout.flush()
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.stress')
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='comma separated point counts, up to 10^6')
+    parser.add_argument('--dists', default=','.join(DISTRIBUTIONS))
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='seconds per run, 0 waits forever')
+    parser.add_argument('--memory', action='store_true',
+                        help='trace allocations, bytes per vertex')
+    args = parser.parse_args(argv[1:])
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    print("%-16s %-8s %9s %9s %9s %10s %10s %9s %10s" % (
+        'distribution', 'engine', 'size', 'inserted', 'seconds',
+        'us/insert', 'worst us', 'work', 'bytes/vtx'))
+    failed = []
+    for n in sizes:
+        for dist in args.dists.split(','):
+            for engine in args.engines.split(','):
+                status, done, rows = run(dist, engine, n, args.seed,
+                                         args.timeout or None, args.memory,
+                                         _print_row)
+                if status != 'ok':
+                    failed.append((dist, engine, n, status, done))
+
+    for dist, engine, n, status, done in failed:
+        print("FAILED %s %s %d: %s after %d inserts"
+              % (dist, engine, n, status, done))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,110 +1,168 @@
 #!/usr/bin/env python
 
-import ctypes as c
-
-import pyglet
-from pyglet.gl import *
-from pyglet.window import mouse, key
-from random import random
-
-from .opengl import ShaderLoader, Mesh, Camera
-from .euclid import *
-from .geometry import Graph, Vertex
-
-# set up a window
-config = pyglet.gl.Config(sample_buffers=1, samples=4, depth_size=24)
-window = pyglet.window.Window(1600, 900, config=config, resizable=False)
-
-keys = key.KeyStateHandler()
-
-# general settings
-window.push_handlers(keys)
-window.set_minimum_size(800, 450)
-mouse_sensitivity = 0.005
-
-# game objects
-shader = ShaderLoader.get_shader()
-glUseProgram(shader.handle)
-meshes = [
-        Mesh(shader, pos=Vector3(-0.85, 0, 0), scale=0.5),
-        Mesh(shader, pos=Vector3(0.85, 0, 0), scale=0.5),
-        ]
-graphs = [
-        Graph(),
-        Graph()
-        ]
-
-graphs[0].add_edge(graphs[0].vertices[0], graphs[0].vertices[2])
-graphs[1].add_edge(graphs[1].vertices[1], graphs[1].vertices[3])
-
-cam = Camera(Vector3(0, -1.0, 1.0), Vector3(0, 1.0, -0.5), Vector3(0, 0, 1))
-cam.set_ortho(1.0, window.width/window.height, 0.1, 10.0)
-proj_gl = cam.get_proj()
-glUniformMatrix4fv(shader.uni('proj'), 1, GL_FALSE, proj_gl)
-
-light_pos = Vector3(0, -0.2, 2)
-light_pos_gl = (GLfloat * len(light_pos[:]))(*light_pos)
-glUniform3fv(shader.uni('lightPos'), 1, light_pos_gl)
-light_color = (1.0, 1.0, 1.0)
-light_color_gl = (GLfloat * len(light_color))(*light_color)
-glUniform3fv(shader.uni('lightColor'), 1, light_color_gl)
-
-glEnable(GL_DEPTH_TEST)
-
-@window.event
-def on_mouse_press(x, y, button, modifiers):
-    global window
-    # add check that depends on where x & y is
-    window.set_exclusive_mouse(True)
-
-@window.event
-def on_mouse_release(x, y, button, modifiers):
-    global window
-    # add check that depends on where x & y is
-    window.set_exclusive_mouse(False)
-
-    p = Vertex(random()*2 - 1, random()*2 - 1, random())
-    graphs[0].add_vertex(p.copy())
-    graphs[1].add_vertex(p.copy())
-    meshes[0].set_vertices(graphs[0].gl_vertices())
-    meshes[1].set_vertices(graphs[1].gl_vertices())
-
-@window.event
-def on_mouse_drag(x, y, dx, dy, button, modifiers):
-    global meshes, mouse_sensitivity
-    for m in meshes:
-        m.rotz += dx * mouse_sensitivity
-
-@window.event
-def on_draw():
-    global meshes
-
-    # draw 3d
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-    for m in meshes:
-        m.draw()
-
-def update(dt):
-    global cam, shader
-
-    if keys[key.W]:
-        cam.pos += cam.at.normalized() * dt
-    if keys[key.S]:
-        cam.pos -= cam.at.normalized() * dt
-    if keys[key.A]:
-        cam.pos -= cam.at.cross(cam.up).normalized() * dt
-    if keys[key.D]:
-        cam.pos += cam.at.cross(cam.up).normalized() * dt
-
-    view_gl = cam.get_view()
-    glUniformMatrix4fv(shader.uni('view'), 1, GL_FALSE, view_gl)
-    view_pos_gl = cam.get_view_pos()
-    glUniform3fv(shader.uni('viewPos'), 1, view_pos_gl)
-
-# generate meshes
-meshes[0].vertices = graphs[0].gl_vertices()
-meshes[1].vertices = graphs[1].gl_vertices()
-
-pyglet.clock.schedule_interval(update, 1/60)
-pyglet.app.run()
-
+import argparse
+import sys
+
+from . import stats
+
+def main(argv=None):
+    """Open the terrain window, or with --bench run the headless timings
+
+    --stats prints rolling per-frame numbers every few seconds,
+    --stats-dump PATH also writes them to PATH as JSON on exit.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(prog='python -m terrain')
+    parser.add_argument('--bench', action='store_true',
+                        help='headless timings, see --bench --help')
+    parser.add_argument('--stats', action='store_true',
+                        help='print per-frame numbers every few seconds')
+    parser.add_argument('--stats-dump', metavar='PATH',
+                        help='also write them to PATH as JSON on exit')
+    args, rest = parser.parse_known_args(argv)
+
+    if args.bench:
+        from .bench import main as bench
+        return bench(argv)
+    if rest:
+        parser.error('unrecognized arguments: ' + ' '.join(rest))
+
+    if args.stats or args.stats_dump:
+        stats.enable()
+
+    run()
+
+    if args.stats_dump:
+        stats.dump(args.stats_dump)
+    return 0
+
+def run():
+    # pyglet opens a display as soon as the GL modules are imported, so
+    # none of this happens until the window is actually wanted
+    from random import random
+
+    import pyglet
+    from pyglet.gl import (
+        GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT, GL_DEPTH_TEST, GLfloat,
+        glClear, glEnable, glUniform3fv, glUseProgram)
+    from pyglet.window import key
+
+    from .euclid import Vector3
+    from .opengl import ShaderLoader, Mesh, Camera
+    from .worker import GeometryWorker
+
+    # set up a window
+    config = pyglet.gl.Config(sample_buffers=1, samples=4, depth_size=24)
+    window = pyglet.window.Window(1600, 900, config=config, resizable=False)
+
+    keys = key.KeyStateHandler()
+
+    # general settings
+    window.push_handlers(keys)
+    window.set_minimum_size(800, 450)
+    mouse_sensitivity = 0.005
+
+    # game objects
+    shader = ShaderLoader.get_shader()
+    glUseProgram(shader.handle)
+    meshes = [
+            Mesh(shader, pos=Vector3(-0.85, 0, 0), scale=0.5),
+            Mesh(shader, pos=Vector3(0.85, 0, 0), scale=0.5),
+            ]
+    # the graphs live in the worker, it sends back vertex buffers
+    worker = GeometryWorker()
+
+    cam = Camera(Vector3(0, -1.0, 1.0), Vector3(0, 1.0, -0.5), Vector3(0, 0, 1))
+    cam.set_ortho(1.0, window.width/window.height, 0.1, 10.0)
+
+    light_pos = Vector3(0, -0.2, 2)
+    light_pos_gl = (GLfloat * len(light_pos[:]))(*light_pos)
+    glUniform3fv(shader.uni('lightPos'), 1, light_pos_gl)
+    light_color = (1.0, 1.0, 1.0)
+    light_color_gl = (GLfloat * len(light_color))(*light_color)
+    glUniform3fv(shader.uni('lightColor'), 1, light_color_gl)
+
+    glEnable(GL_DEPTH_TEST)
+
+    @window.event
+    def on_mouse_press(x, y, button, modifiers):
+        # add check that depends on where x & y is
+        window.set_exclusive_mouse(True)
+
+    @window.event
+    def on_mouse_release(x, y, button, modifiers):
+        # add check that depends on where x & y is
+        window.set_exclusive_mouse(False)
+
+        with stats.timer('on_mouse_release'):
+            # only posts the edit, the worker does the insertion
+            worker.add_vertex(random()*2 - 1, random()*2 - 1, random())
+
+    @window.event
+    def on_mouse_drag(x, y, dx, dy, button, modifiers):
+        for m in meshes:
+            m.rotz += dx * mouse_sensitivity
+
+    @window.event
+    def on_key_press(symbol, modifiers):
+        # ctrl+z undoes the last edit, ctrl+y or ctrl+shift+z redoes it
+        if not modifiers & key.MOD_CTRL:
+            return
+        if symbol == key.Z and not modifiers & key.MOD_SHIFT:
+            worker.undo()
+        elif symbol in (key.Y, key.Z):
+            worker.redo()
+
+    @window.event
+    def on_draw():
+        # draw 3d
+        with stats.timer('on_draw'):
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            for m in meshes:
+                m.draw()
+        stats.frame()
+
+    def update(dt):
+        with stats.timer('update'):
+            # swap in whatever the worker finished since the last frame
+            with stats.timer('swap'):
+                for i, vertices in worker.poll().items():
+                    meshes[i].set_vertices(vertices)
+            for error in worker.errors:
+                print('edit failed:', error)
+            del worker.errors[:]
+
+            if keys[key.W]:
+                cam.pos += cam.to.normalized() * dt
+            if keys[key.S]:
+                cam.pos -= cam.to.normalized() * dt
+            if keys[key.A]:
+                cam.pos -= cam.to.cross(cam.up).normalized() * dt
+            if keys[key.D]:
+                cam.pos += cam.to.cross(cam.up).normalized() * dt
+
+            # only sends anything when the camera moved
+            cam.upload(shader)
+
+    def print_stats(dt):
+        print(stats.report())
+
+    # generate meshes
+    ready = dict()
+    while len(ready) < len(meshes):
+        ready.update(worker.poll(None))
+    for i, vertices in ready.items():
+        meshes[i].set_vertices(vertices)
+
+    pyglet.clock.schedule_interval(update, 1/60)
+    if stats.enabled:
+        pyglet.clock.schedule_interval(print_stats, 5)
+    try:
+        pyglet.app.run()
+    finally:
+        worker.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import numpy as np
+
+from .euclid import Point3, Vector3
+
+class Vector3Array:
+    """An (N, 3) float array of vectors with the Vector3 API
+
+    Operators follow the same result classes as the scalar types and accept
+    another array of the same length, a single Vector3 or a 3-tuple, which
+    is applied to every row, on either side. Multiplying by a vector is
+    component-wise like Vector3 * Vector3; a plain list or 1-D numpy array
+    gives one scalar per row.
+    """
+    __slots__ = ('data',)
+    _scalar = Vector3
+    # numpy operands and Vector3 leave their operators with an array to it
+    __array_ufunc__ = None
+
+    def __init__(self, data=()):
+        self.data = np.array(data, dtype=float).reshape(-1, 3)
+
+    @classmethod
+    def from_vectors(cls, vectors):
+        return cls([(v.x, v.y, v.z) for v in vectors])
+
+    def to_vectors(self):
+        _class = self._scalar
+        return [_class(x, y, z) for x, y, z in self.data.tolist()]
+
+    def copy(self):
+        return self.__class__(self.data)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.data.tolist())
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.__class__(self.data[key])
+        return self._scalar(*self.data[key].tolist())
+
+    def __setitem__(self, key, value):
+        self.data[key] = _rows(value)
+
+    def __iter__(self):
+        return iter(self.to_vectors())
+
+    def __eq__(self, other):
+        return np.array_equal(self.data, _rows(other))
+
+    __hash__ = None
+
+    def __add__(self, other):
+        # Vector + Vector -> Vector
+        # Vector + Point -> Point
+        # Point + Point -> Vector
+        if _is_point(self) == _is_point(other):
+            _class = Vector3Array
+        else:
+            _class = Point3Array
+        return _class(self.data + _rows(other))
+
+    __radd__ = __add__
+
+    def __iadd__(self, other):
+        self.data += _rows(other)
+        return self
+
+    def __sub__(self, other):
+        return Vector3Array(self.data - _rows(other))
+
+    def __rsub__(self, other):
+        return Vector3Array(_rows(other) - self.data)
+
+    def __mul__(self, other):
+        # vectors multiply component-wise, and any point makes it a point
+        _class = Point3Array if _is_point(self) or _is_point(other) \
+            else Vector3Array
+        return _class(self.data * _factor(other))
+
+    __rmul__ = __mul__
+
+    def __imul__(self, other):
+        self.data *= _factor(other)
+        return self
+
+    def __truediv__(self, other):
+        return Vector3Array(self.data / _factor(other))
+
+    def __neg__(self):
+        return Vector3Array(-self.data)
+
+    def magnitude_squared(self):
+        return np.einsum('ij,ij->i', self.data, self.data)
+
+    def magnitude(self):
+        return np.sqrt(self.magnitude_squared())
+
+    __abs__ = magnitude
+
+    def normalize(self):
+        # zero length rows are left alone, like Vector3.normalize
+        d = self.magnitude()
+        d[d == 0] = 1
+        self.data /= d[:, None]
+        return self
+
+    def normalized(self):
+        return Vector3Array(self.data).normalize()
+
+    def dot(self, other):
+        other = _rows(other)
+        if other.ndim == 1:
+            return self.data @ other
+        return np.einsum('ij,ij->i', self.data, other)
+
+    def cross(self, other):
+        return Vector3Array(np.cross(self.data, _rows(other)))
+
+class Point3Array(Vector3Array):
+    __slots__ = ()
+    _scalar = Point3
+
+def _is_point(value):
+    return isinstance(value, (Point3, Point3Array))
+
+def _rows(value):
+    if isinstance(value, Vector3Array):
+        return value.data
+    if isinstance(value, Vector3):
+        return np.array((value.x, value.y, value.z))
+    return np.asarray(value, dtype=float)
+
+def _factor(value):
+    # a scalar, one scalar per row, or vectors applied per component
+    if isinstance(value, (Vector3, Vector3Array, tuple)):
+        return _rows(value)
+    value = np.asarray(value, dtype=float)
+    if value.ndim == 1:
+        return value[:, None]
+    return value
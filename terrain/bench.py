@@ -0,0 +1,105 @@
+"""Headless timings of the geometry and export pipeline
+
+    python -m terrain --bench [--sizes 1000,10000] [--repeat 3] [--seed 0]
+
+Nothing here imports pyglet, so it runs without a display.
+"""
+
+import argparse
+import time
+from random import Random
+
+from .delaunay import delaunay
+from .euclid import Matrix4, Matrix4Pool
+from .geometry import Graph, Vertex
+
+def _best(repeat, setup, stage):
+    # fastest of repeat runs, stage gets whatever setup returns
+    best = None
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        result = stage(arg)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def _points(n, seed):
+    rand = Random(seed)
+    return [(rand.uniform(-1, 1), rand.uniform(-1, 1), rand.random())
+            for _ in range(n)]
+
+def _graph():
+    graph = Graph()
+    graph.add_edge(graph.vertices[0], graph.vertices[2])
+    return graph
+
+def _insert(points):
+    graph = _graph()
+    for p in points:
+        graph.add_vertex(Vertex(*p))
+    return graph
+
+def _insert_batch(points):
+    graph = _graph()
+    graph.add_vertices([Vertex(*p) for p in points])
+    return graph
+
+def _matrices(n):
+    # what Mesh.draw does when a transform changed
+    model = Matrix4()
+    pool = Matrix4Pool()
+    buf = [0.0] * 16
+    for i in range(n):
+        model.set_trs(0.5, 0.0, 0.0, i * 0.001, 0.5, 0.5, 0.5)
+        model.elements_into(buf)
+        norm = model.inverse_into(pool.get())
+        norm.transpose()
+        norm.elements_into(buf)
+        pool.release(norm)
+    return n
+
+def run(sizes, repeat=3, seed=0):
+    """Return (stage, size, seconds, items, walk steps per insert) rows
+    for every size, the last is None for stages that don't insert"""
+    rows = []
+    for n in sizes:
+        points = _points(n, seed)
+        t, graph = _best(repeat, lambda: points, _insert)
+        rows.append(('insert', n, t, n, graph.walk_steps / n))
+
+        t, batch = _best(repeat, lambda: points, _insert_batch)
+        rows.append(('insert batch', n, t, n, batch.walk_steps / n))
+
+        t, _ = _best(repeat, lambda: points, delaunay)
+        rows.append(('delaunay', n, t, n, None))
+
+        t, flat = _best(repeat, lambda: graph, lambda g: g.gl_vertices())
+        rows.append(('gl_vertices', n, t, len(flat) // 9, None))
+
+        t, smooth = _best(repeat, lambda: graph,
+                          lambda g: g.gl_vertices(smooth=True))
+        rows.append(('gl_vertices smooth', n, t, len(smooth) // 9, None))
+
+        t, count = _best(repeat, lambda: n, _matrices)
+        rows.append(('matrix setup', n, t, count, None))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m terrain --bench')
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--sizes', default='1000,5000',
+                        help='comma separated point counts')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    print("%-20s %8s %10s %14s %12s" % (
+        'stage', 'size', 'seconds', 'items/s', 'steps/insert'))
+    for stage, n, t, items, steps in run(sizes, args.repeat, args.seed):
+        rate = items / t if t else float('inf')
+        print("%-20s %8d %10.4f %14.0f %12s" % (
+            stage, n, t, rate, '' if steps is None else '%.1f' % steps))
+    return 0
@@ -0,0 +1,56 @@
+from bisect import bisect_right
+
+from .euclid import Point3
+
+def contours(graph, levels):
+    """Return the isolines of graph at each height in levels
+
+    The result maps every level to a list of polylines, each a list of
+    Point3 with the higher terrain on its left. Closed loops repeat their
+    first point at the end. The faces are visited once; for each face only
+    the levels between its lowest and highest corner are considered.
+    """
+    levels = sorted(set(levels))
+    # per level, map the halfedge a segment enters its face through to the
+    # one it leaves through
+    links = [dict() for _ in levels]
+    for face in graph.faces():
+        zs = [he.origin.z for he in face]
+        for k in range(bisect_right(levels, min(zs)),
+                       bisect_right(levels, max(zs))):
+            c = levels[k]
+            entry = exit = None
+            for he in face:
+                if he.origin.z >= c and he.twin.origin.z < c:
+                    entry = he
+                elif he.origin.z < c and he.twin.origin.z >= c:
+                    exit = he
+            links[k][entry] = exit
+
+    return dict((c, _chain(link, c)) for c, link in zip(levels, links))
+
+def _chain(link, c):
+    polylines = []
+    exits = set(he.twin for he in link.values())
+    # open polylines start on the boundary, where no segment leads in
+    starts = [he for he in link if he not in exits]
+    starts += [he for he in link if he in exits]
+    for start in starts:
+        if start not in link:
+            continue
+        line = [_crossing(start, c)]
+        he = start
+        while he in link:
+            he = link.pop(he)
+            line.append(_crossing(he, c))
+            he = he.twin
+        polylines.append(line)
+    return polylines
+
+def _crossing(he, c):
+    # interpolate from the lower end so both halfedges give the same point
+    lo, hi = he.origin, he.twin.origin
+    if lo.z >= c:
+        lo, hi = hi, lo
+    t = (c - lo.z) / (hi.z - lo.z)
+    return Point3(lo.x + t * (hi.x - lo.x), lo.y + t * (hi.y - lo.y), c)
@@ -0,0 +1,264 @@
+"""Delaunay triangulation by randomized incremental construction
+
+An alternative to Graph's walking insertion for building a terrain from a
+batch of points. The convex hull is triangulated first, then the interior
+points are inserted in random order. Every triangle keeps a conflict list
+of the points not inserted yet that lie inside it, so an insertion finds
+its triangle directly. Lawson flips restore the Delaunay property after
+each insertion and hand the conflicts of the flipped triangles to the new
+ones. This gives an expected O(n log n) construction. Hull edges are never
+flipped, so the result covers exactly the convex hull, like Graph(points).
+
+The work is done on plain index triples by a Triangulation and the result
+is converted to a Graph at the end.
+"""
+
+from fractions import Fraction
+from random import Random
+
+from . import stats
+from .geometry import (
+    Graph, ccw, convex_ears, convex_hull, hilbert_sort, unique_vertices)
+
+def delaunay(points, seed=0):
+    """Return a Graph of the Delaunay triangulation of points
+
+    points are Vertex objects or (x, y, height) tuples. Repeated positions
+    are dropped and ValueError is raised if the points are colinear.
+    """
+    vertices = unique_vertices(points)
+    hull = convex_hull(vertices)
+    if len(hull) < 3:
+        raise ValueError('points are colinear')
+
+    index = dict((id(v), i) for i, v in enumerate(vertices))
+    on_hull = set(id(v) for v in hull)
+    interior = [index[id(v)] for v in vertices if id(v) not in on_hull]
+
+    t = Triangulation(vertices, Random(seed))
+    t.triangulate_hull([index[id(v)] for v in hull])
+    t.distribute(interior)
+    order = list(interior)
+    t.rand.shuffle(order)
+    for p in order:
+        t.insert(p)
+
+    return Graph.from_triangles(vertices, t.triangles())
+
+# Shewchuk's bound on the rounding error of incircle, relative to the sum
+# of the magnitudes of its terms
+_INCIRCLE_ERROR = (10 + 96 * 2.0 ** -53) * 2.0 ** -53
+
+def incircle(a, b, c, d):
+    """Positive if d is inside the circle through counter-clockwise a, b, c
+
+    Like ccw the sign is exact, results near zero are redone with
+    fractions.
+    """
+    adx = a.x - d.x
+    ady = a.y - d.y
+    bdx = b.x - d.x
+    bdy = b.y - d.y
+    cdx = c.x - d.x
+    cdy = c.y - d.y
+    bdxcdy = bdx * cdy
+    cdxbdy = cdx * bdy
+    cdxady = cdx * ady
+    adxcdy = adx * cdy
+    adxbdy = adx * bdy
+    bdxady = bdx * ady
+    alift = adx * adx + ady * ady
+    blift = bdx * bdx + bdy * bdy
+    clift = cdx * cdx + cdy * cdy
+    det = (alift * (bdxcdy - cdxbdy) + blift * (cdxady - adxcdy)
+           + clift * (adxbdy - bdxady))
+    permanent = ((abs(bdxcdy) + abs(cdxbdy)) * alift
+                 + (abs(cdxady) + abs(adxcdy)) * blift
+                 + (abs(adxbdy) + abs(bdxady)) * clift)
+    if abs(det) >= _INCIRCLE_ERROR * permanent:
+        return det
+    dx = Fraction(d.x)
+    dy = Fraction(d.y)
+    adx = Fraction(a.x) - dx
+    ady = Fraction(a.y) - dy
+    bdx = Fraction(b.x) - dx
+    bdy = Fraction(b.y) - dy
+    cdx = Fraction(c.x) - dx
+    cdy = Fraction(c.y) - dy
+    return float((adx * adx + ady * ady) * (bdx * cdy - cdx * bdy)
+                 + (bdx * bdx + bdy * bdy) * (cdx * ady - adx * cdy)
+                 + (cdx * cdx + cdy * cdy) * (adx * bdy - bdx * ady))
+
+class Triangulation:
+    """The steps of delaunay() on indices into vertices
+
+    Call triangulate_hull() with the hull corners, distribute() with the
+    remaining points and then insert() each of them, in the order given by
+    rand for the expected O(n log n). Triangles are counter-clockwise index
+    triples, and owner maps each directed edge (u, w) to the triangle on
+    its left, so the neighbour across it is owner[w, u]. flips counts the
+    Lawson flips done so far.
+    """
+    def __init__(self, vertices, rand):
+        self.pts = vertices
+        self.rand = rand
+        self.tris = []
+        self.conflicts = []
+        self.owner = dict()
+        self.flips = 0
+
+    def triangles(self):
+        """Return the current triangles"""
+        return [tri for tri in self.tris if tri is not None]
+
+    def _add(self, a, b, c):
+        t = len(self.tris)
+        self.tris.append((a, b, c))
+        self.conflicts.append([])
+        owner = self.owner
+        owner[a, b] = owner[b, c] = owner[c, a] = t
+        return t
+
+    def _kill(self, t):
+        a, b, c = self.tris[t]
+        owner = self.owner
+        for edge in ((a, b), (b, c), (c, a)):
+            if owner.get(edge) == t:
+                del owner[edge]
+        self.tris[t] = None
+        points = self.conflicts[t]
+        self.conflicts[t] = None
+        return points
+
+    def apex(self, t, u, w):
+        """Return the corner of triangle t opposite its edge (u, w)"""
+        a, b, c = self.tris[t]
+        if (a, b) == (u, w):
+            return c
+        if (b, c) == (u, w):
+            return a
+        return b
+
+    def _assign_fan(self, points, p, ring, new):
+        # new[i] is (ring[i], ring[i + 1], p); a point belongs to the wedge
+        # between the rays from p through ring[i] and ring[i + 1]
+        pts = self.pts
+        conflicts = self.conflicts
+        location = self.location
+        center = pts[p]
+        corners = [pts[r] for r in ring]
+        k = len(ring)
+        for i in points:
+            q = pts[i]
+            sides = [ccw(center, r, q) for r in corners]
+            t = new[0]
+            for j in range(k):
+                if sides[j] >= 0 and sides[(j + 1) % k] <= 0:
+                    t = new[j]
+                    break
+            conflicts[t].append(i)
+            location[i] = t
+
+    def _assign_split(self, points, p, d, left, right):
+        # after a flip the new edge pd separates the two new triangles
+        pts = self.pts
+        conflicts = self.conflicts
+        location = self.location
+        a, b = pts[p], pts[d]
+        for i in points:
+            t = left if ccw(a, b, pts[i]) > 0 else right
+            conflicts[t].append(i)
+            location[i] = t
+
+    def triangulate_hull(self, hull):
+        """Triangulate the counter-clockwise hull corners"""
+        # clip ears as Graph does, then flip to Delaunay
+        pts = self.pts
+        index = dict((id(pts[i]), i) for i in hull)
+        for ear in convex_ears([pts[i] for i in hull]):
+            self._add(*[index[id(v)] for v in ear])
+        self.location = dict()
+        self._legalize([edge for edge in self.owner])
+
+    def distribute(self, points):
+        """Find the triangle of each point that is still to be inserted"""
+        # one walk per point to fill the first conflict lists, in Hilbert
+        # order so each walk starts next to where the last one ended
+        pts = self.pts
+        index = dict((id(pts[i]), i) for i in points)
+        t = next(t for t, tri in enumerate(self.tris) if tri is not None)
+        for q in hilbert_sort([pts[i] for i in points]):
+            t = self._walk(t, q)
+            i = index[id(q)]
+            self.conflicts[t].append(i)
+            self.location[i] = t
+
+    def _walk(self, t, q):
+        pts = self.pts
+        rand = self.rand
+        while True:
+            a, b, c = self.tris[t]
+            edges = ((a, b), (b, c), (c, a))
+            # start from a random edge so the walk can't cycle
+            k = rand.randrange(3)
+            for j in range(3):
+                u, w = edges[(j + k) % 3]
+                if ccw(pts[u], pts[w], q) < 0:
+                    t = self.owner[w, u]
+                    break
+            else:
+                return t
+
+    def insert(self, p):
+        """Insert the distributed point p and flip until Delaunay again"""
+        pts = self.pts
+        t = self.location.pop(p)
+        a, b, c = self.tris[t]
+        q = pts[p]
+
+        # the corners around p, counter-clockwise; a point on an edge
+        # takes the triangle across it along
+        ring = [a, b, c]
+        for u, w, rest in ((a, b, [b, c, a]), (b, c, [c, a, b]),
+                           (c, a, [a, b, c])):
+            if ccw(pts[u], pts[w], q) == 0 and (w, u) in self.owner:
+                other = self.owner[w, u]
+                ring = rest + [self.apex(other, w, u)]
+                points = self._kill(other)
+                break
+        else:
+            points = []
+        points += self._kill(t)
+
+        new = [self._add(ring[i], ring[(i + 1) % len(ring)], p)
+               for i in range(len(ring))]
+        points.remove(p)
+        self._assign_fan(points, p, ring, new)
+        self._legalize([(ring[i], ring[(i + 1) % len(ring)])
+                        for i in range(len(ring))])
+
+    def _legalize(self, edges):
+        pts = self.pts
+        owner = self.owner
+        while edges:
+            u, w = edges.pop()
+            t = owner.get((u, w))
+            o = owner.get((w, u))
+            if t is None or o is None:
+                # hull edge, or already flipped away
+                continue
+            p = self.apex(t, u, w)
+            d = self.apex(o, w, u)
+            if incircle(pts[u], pts[w], pts[p], pts[d]) <= 0:
+                continue
+
+            points = self._kill(t) + self._kill(o)
+            right = self._add(p, u, d)
+            left = self._add(p, d, w)
+            self._assign_split(points, p, d, left, right)
+            self.flips += 1
+            if stats.enabled:
+                stats.count('flips')
+            # the edges that now face the new corner
+            edges.append((u, d))
+            edges.append((d, w))
@@ -32,17 +32,18 @@ __version__ = '$Id$'
 __revision__ = '$Revision$'
 
 import math
+import numbers
 import operator
-import types
 
 try:
     long
 except NameError:
     long = int
 
-# Some magic here.  If _use_slots is True, the classes will derive from
-# object and will define a __slots__ class variable.  If _use_slots is
-# False, classes will be old-style and will not define __slots__.
+# Some magic here.  If _use_slots is True, the classes will define a
+# __slots__ class variable (an empty one if they don't list any attributes
+# themselves) so instances carry no __dict__.  If _use_slots is False,
+# classes will be ordinary classes and will not define __slots__.
 #
 # _use_slots = True:   Memory efficient, probably faster in future versions
 #                      of Python, "better".
@@ -60,38 +61,71 @@ _enable_swizzle_set = False
 if _enable_swizzle_set:
     _use_slots = True
 
-# Implement _use_slots magic.
+# Implement _use_slots magic.  Python 3 ignores a module level __metaclass__,
+# so every root class below names the metaclass explicitly; subclasses
+# inherit it.  Only classes defined in this module get empty slots by
+# default, subclasses elsewhere (e.g. geometry.Vertex) keep their __dict__.
 class _EuclidMetaclass(type):
     def __new__(cls, name, bases, dct):
-        if '__slots__' in dct:
-            dct['__getstate__'] = cls._create_getstate(dct['__slots__'])
-            dct['__setstate__'] = cls._create_setstate(dct['__slots__'])
         if _use_slots:
-            return type.__new__(cls, name, bases + (object,), dct)
-        else:
-            if '__slots__' in dct:
-                del dct['__slots__']
-            return types.ClassType.__new__(types.ClassType, name, bases, dct)
+            if dct.get('__module__') == __name__:
+                dct.setdefault('__slots__', ())
+        elif '__slots__' in dct:
+            del dct['__slots__']
+        if '__slots__' in dct:
+            dct['__getstate__'] = cls._create_getstate()
+            dct['__setstate__'] = cls._create_setstate()
+        return type.__new__(cls, name, bases, dct)
 
     @classmethod
-    def _create_getstate(cls, slots):
+    def _create_getstate(cls):
         def __getstate__(self):
             d = {}
-            for slot in slots:
-                d[slot] = getattr(self, slot)
+            for klass in self.__class__.__mro__:
+                for slot in klass.__dict__.get('__slots__', ()):
+                    d[slot] = getattr(self, slot)
+            d.update(getattr(self, '__dict__', ()))
             return d
         return __getstate__
 
     @classmethod
-    def _create_setstate(cls, slots):
+    def _create_setstate(cls):
         def __setstate__(self, state):
             for name, value in state.items():
                 setattr(self, name, value)
         return __setstate__
 
-__metaclass__ = _EuclidMetaclass
+# Fast paths for the Vector3 operators.  Results are built with
+# object.__new__ and filled in directly instead of going through __init__,
+# and the class an addition returns is cached per pair of operand classes.
+_new = object.__new__
+_sqrt = math.sqrt
+_swizzle3 = {'x': 0, 'y': 1, 'z': 2}
+_add3_classes = {}
+# plain sequences Vector3 operators take as a vector without further checks
+_sequences = (tuple, list)
+
+def _is_sequence(other):
+    # other sized operands such as numpy arrays are taken as well, unless
+    # they opt out of numpy's operators like Vector3Array does; those get
+    # NotImplemented so their reflected operator can run
+    if other.__class__ in _sequences:
+        return True
+    return hasattr(other, '__len__') and \
+        getattr(other.__class__, '__array_ufunc__', 0) is not None
+
+def _add3_class(a, b):
+    # Vector + Vector -> Vector
+    # Vector + Point -> Point
+    # Point + Point -> Vector
+    if issubclass(b, Vector3):
+        _class = Vector3 if a is b else Point3
+    else:
+        _class = None
+    _add3_classes[a, b] = _class
+    return _class
 
-class Vector2:
+class Vector2(metaclass=_EuclidMetaclass):
     __slots__ = ['x', 'y']
     __hash__ = None
 
@@ -310,9 +344,11 @@ class Vector2:
         n = other.normalized()
         return self.dot(n)*n
 
-class Vector3:
+class Vector3(metaclass=_EuclidMetaclass):
     __slots__ = ['x', 'y', 'z']
     __hash__ = None
+    # numpy scalars and arrays leave their operators with a Vector3 to it
+    __array_ufunc__ = None
 
     def __init__(self, x=0, y=0, z=0):
         self.x = x
@@ -361,10 +397,14 @@ class Vector3:
         return iter((self.x, self.y, self.z))
 
     def __getattr__(self, name):
+        # only reached on misses; dunder probes from copy, pickle or numpy
+        # can never be swizzles so don't build anything for them
+        if name.startswith('_'):
+            raise AttributeError(name)
         try:
-            return tuple([(self.x, self.y, self.z)['xyz'.index(c)] \
+            return tuple([(self.x, self.y, self.z)[_swizzle3[c]] \
                           for c in name])
-        except ValueError:
+        except KeyError:
             raise AttributeError(name)
 
     if _enable_swizzle_set:
@@ -384,22 +424,23 @@ class Vector3:
 
 
     def __add__(self, other):
-        if isinstance(other, Vector3):
-            # Vector + Vector -> Vector
-            # Vector + Point -> Point
-            # Point + Point -> Vector
-            if self.__class__ is other.__class__:
-                _class = Vector3
-            else:
-                _class = Point3
-            return _class(self.x + other.x,
-                          self.y + other.y,
-                          self.z + other.z)
-        else:
-            assert hasattr(other, '__len__') and len(other) == 3
+        try:
+            _class = _add3_classes[self.__class__, other.__class__]
+        except KeyError:
+            _class = _add3_class(self.__class__, other.__class__)
+        if _class is not None:
+            V = _new(_class)
+            V.x = self.x + other.x
+            V.y = self.y + other.y
+            V.z = self.z + other.z
+            return V
+        elif _is_sequence(other):
+            assert len(other) == 3
             return Vector3(self.x + other[0],
                            self.y + other[1],
                            self.z + other[2])
+        # e.g. a Vector3Array, which knows how to add a Vector3
+        return NotImplemented
     __radd__ = __add__
 
     def __iadd__(self, other):
@@ -416,20 +457,19 @@ class Vector3:
     def __sub__(self, other):
         if isinstance(other, Vector3):
             # Vector - Vector -> Vector
-            # Vector - Point -> Point
+            # Vector - Point -> Vector
             # Point - Point -> Vector
-            if self.__class__ is other.__class__:
-                _class = Vector3
-            else:
-                _class = Point3
-            return Vector3(self.x - other.x,
-                           self.y - other.y,
-                           self.z - other.z)
-        else:
-            assert hasattr(other, '__len__') and len(other) == 3
+            V = _new(Vector3)
+            V.x = self.x - other.x
+            V.y = self.y - other.y
+            V.z = self.z - other.z
+            return V
+        elif _is_sequence(other):
+            assert len(other) == 3
             return Vector3(self.x - other[0],
                            self.y - other[1],
                            self.z - other[2])
+        return NotImplemented
 
    
     def __rsub__(self, other):
@@ -437,32 +477,43 @@ class Vector3:
             return Vector3(other.x - self.x,
                            other.y - self.y,
                            other.z - self.z)
-        else:
-            assert hasattr(other, '__len__') and len(other) == 3
-            return Vector3(other.x - self[0],
-                           other.y - self[1],
-                           other.z - self[2])
+        elif _is_sequence(other):
+            assert len(other) == 3
+            return Vector3(other[0] - self.x,
+                           other[1] - self.y,
+                           other[2] - self.z)
+        return NotImplemented
 
     def __mul__(self, other):
-        if isinstance(other, Vector3):
+        _class = other.__class__
+        if _class is float or _class is int:
+            V = _new(Vector3)
+            V.x = self.x * other
+            V.y = self.y * other
+            V.z = self.z * other
+            return V
+        elif isinstance(other, Vector3):
             # TODO component-wise mul/div in-place and on Vector2; docs.
-            if self.__class__ is Point3 or other.__class__ is Point3:
+            if self.__class__ is Point3 or _class is Point3:
                 _class = Point3
             else:
                 _class = Vector3
-            return _class(self.x * other.x,
-                          self.y * other.y,
-                          self.z * other.z)
-        else: 
-            assert type(other) in (int, long, float)
+            V = _new(_class)
+            V.x = self.x * other.x
+            V.y = self.y * other.y
+            V.z = self.z * other.z
+            return V
+        elif isinstance(other, numbers.Real):
+            # e.g. numpy's float64
             return Vector3(self.x * other,
                            self.y * other,
                            self.z * other)
+        return NotImplemented
 
     __rmul__ = __mul__
 
     def __imul__(self, other):
-        assert type(other) in (int, long, float)
+        assert isinstance(other, numbers.Real)
         self.x *= other
         self.y *= other
         self.z *= other
@@ -495,10 +546,14 @@ class Vector3:
                        operator.floordiv(other, self.z))
 
     def __truediv__(self, other):
-        assert type(other) in (int, long, float)
-        return Vector3(operator.truediv(self.x, other),
-                       operator.truediv(self.y, other),
-                       operator.truediv(self.z, other))
+        _class = other.__class__
+        if _class is not float and _class is not int:
+            assert isinstance(other, numbers.Real)
+        V = _new(Vector3)
+        V.x = self.x / other
+        V.y = self.y / other
+        V.z = self.z / other
+        return V
 
 
     def __rtruediv__(self, other):
@@ -508,38 +563,50 @@ class Vector3:
                        operator.truediv(other, self.z))
     
     def __neg__(self):
-        return Vector3(-self.x,
-                        -self.y,
-                        -self.z)
+        V = _new(Vector3)
+        V.x = -self.x
+        V.y = -self.y
+        V.z = -self.z
+        return V
 
     __pos__ = __copy__
     
     def __abs__(self):
-        return math.sqrt(self.x ** 2 + \
-                         self.y ** 2 + \
-                         self.z ** 2)
+        x = self.x
+        y = self.y
+        z = self.z
+        return _sqrt(x * x + y * y + z * z)
 
     magnitude = __abs__
 
     def magnitude_squared(self):
-        return self.x ** 2 + \
-               self.y ** 2 + \
-               self.z ** 2
+        x = self.x
+        y = self.y
+        z = self.z
+        return x * x + y * y + z * z
 
     def normalize(self):
-        d = self.magnitude()
+        x = self.x
+        y = self.y
+        z = self.z
+        d = _sqrt(x * x + y * y + z * z)
         if d:
-            self.x /= d
-            self.y /= d
-            self.z /= d
+            self.x = x / d
+            self.y = y / d
+            self.z = z / d
         return self
 
     def normalized(self):
-        d = self.magnitude()
+        x = self.x
+        y = self.y
+        z = self.z
+        d = _sqrt(x * x + y * y + z * z)
         if d:
-            return Vector3(self.x / d, 
-                           self.y / d, 
-                           self.z / d)
+            V = _new(Vector3)
+            V.x = x / d
+            V.y = y / d
+            V.z = z / d
+            return V
         return self.copy()
 
     def dot(self, other):
@@ -550,9 +617,17 @@ class Vector3:
 
     def cross(self, other):
         assert isinstance(other, Vector3)
-        return Vector3(self.y * other.z - self.z * other.y,
-                       -self.x * other.z + self.z * other.x,
-                       self.x * other.y - self.y * other.x)
+        Ax = self.x
+        Ay = self.y
+        Az = self.z
+        Bx = other.x
+        By = other.y
+        Bz = other.z
+        V = _new(Vector3)
+        V.x = Ay * Bz - Az * By
+        V.y = -Ax * Bz + Az * Bx
+        V.z = Ax * By - Ay * Bx
+        return V
 
     def reflect(self, normal):
         # assume normal is normalized
@@ -593,7 +668,7 @@ class Vector3:
 # e f g 
 # i j k 
 
-class Matrix3:
+class Matrix3(metaclass=_EuclidMetaclass):
     __slots__ = list('abcefgijk')
 
     def __init__(self):
@@ -799,7 +874,7 @@ class Matrix3:
 # i j k l
 # m n o p
 
-class Matrix4:
+class Matrix4(metaclass=_EuclidMetaclass):
     __slots__ = list('abcdefghijklmnop')
 
     def __init__(self):
@@ -993,6 +1068,29 @@ class Matrix4:
             P.z /= w
         return P
 
+    def transform_many(self, points):
+        '''Apply transform() to every row of an (N, 3) array of points.
+
+        Accepts anything numpy can turn into an (N, 3) array, or a
+        Point3Array, and returns the same kind.  Affine matrices skip the
+        divide by w.  Needs numpy.
+        '''
+        import numpy as np
+        wrap = None
+        if hasattr(points, 'data') and hasattr(points, 'to_vectors'):
+            wrap = points.__class__
+            points = points.data
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        M = np.array(self[:], dtype=float).reshape(4, 4).T
+        result = points @ M[:3, :3].T + M[:3, 3]
+        if self.m or self.n or self.o or self.p != 1:
+            w = points @ M[3, :3] + M[3, 3]
+            w[w == 0] = 1
+            result /= w[:, None]
+        if wrap is not None:
+            return wrap(result)
+        return result
+
     def identity(self):
         self.a = self.f = self.k = self.p = 1.
         self.b = self.c = self.d = self.e = self.g = self.h = \
@@ -1046,6 +1144,137 @@ class Matrix4:
         M.transpose()
         return M
 
+    # In-place variants that write into an existing matrix instead of
+    # allocating a new one.  out may be self or other.
+    def mul_into(self, other, out):
+        assert isinstance(other, Matrix4)
+        Aa = self.a
+        Ab = self.b
+        Ac = self.c
+        Ad = self.d
+        Ae = self.e
+        Af = self.f
+        Ag = self.g
+        Ah = self.h
+        Ai = self.i
+        Aj = self.j
+        Ak = self.k
+        Al = self.l
+        Am = self.m
+        An = self.n
+        Ao = self.o
+        Ap = self.p
+        Ba = other.a
+        Bb = other.b
+        Bc = other.c
+        Bd = other.d
+        Be = other.e
+        Bf = other.f
+        Bg = other.g
+        Bh = other.h
+        Bi = other.i
+        Bj = other.j
+        Bk = other.k
+        Bl = other.l
+        Bm = other.m
+        Bn = other.n
+        Bo = other.o
+        Bp = other.p
+        out.a = Aa * Ba + Ab * Be + Ac * Bi + Ad * Bm
+        out.b = Aa * Bb + Ab * Bf + Ac * Bj + Ad * Bn
+        out.c = Aa * Bc + Ab * Bg + Ac * Bk + Ad * Bo
+        out.d = Aa * Bd + Ab * Bh + Ac * Bl + Ad * Bp
+        out.e = Ae * Ba + Af * Be + Ag * Bi + Ah * Bm
+        out.f = Ae * Bb + Af * Bf + Ag * Bj + Ah * Bn
+        out.g = Ae * Bc + Af * Bg + Ag * Bk + Ah * Bo
+        out.h = Ae * Bd + Af * Bh + Ag * Bl + Ah * Bp
+        out.i = Ai * Ba + Aj * Be + Ak * Bi + Al * Bm
+        out.j = Ai * Bb + Aj * Bf + Ak * Bj + Al * Bn
+        out.k = Ai * Bc + Aj * Bg + Ak * Bk + Al * Bo
+        out.l = Ai * Bd + Aj * Bh + Ak * Bl + Al * Bp
+        out.m = Am * Ba + An * Be + Ao * Bi + Ap * Bm
+        out.n = Am * Bb + An * Bf + Ao * Bj + Ap * Bn
+        out.o = Am * Bc + An * Bg + Ao * Bk + Ap * Bo
+        out.p = Am * Bd + An * Bh + Ao * Bl + Ap * Bp
+        return out
+
+    def inverse_into(self, out):
+        a = self.a
+        b = self.b
+        c = self.c
+        d = self.d
+        e = self.e
+        f = self.f
+        g = self.g
+        h = self.h
+        i = self.i
+        j = self.j
+        k = self.k
+        l = self.l
+        m = self.m
+        n = self.n
+        o = self.o
+        p = self.p
+        det = self.determinant()
+        if abs(det) < 0.001:
+            # No inverse, set identity like inverse() does
+            return out.identity()
+        det = 1.0 / det
+        out.a = det * (f * (k * p - o * l) + j * (o * h - g * p) + n * (g * l - k * h))
+        out.e = det * (g * (i * p - m * l) + k * (m * h - e * p) + o * (e * l - i * h))
+        out.i = det * (h * (i * n - m * j) + l * (m * f - e * n) + p * (e * j - i * f))
+        out.m = det * (e * (n * k - j * o) + i * (f * o - n * g) + m * (j * g - f * k))
+        out.b = det * (j * (c * p - o * d) + n * (k * d - c * l) + b * (o * l - k * p))
+        out.f = det * (k * (a * p - m * d) + o * (i * d - a * l) + c * (m * l - i * p))
+        out.j = det * (l * (a * n - m * b) + p * (i * b - a * j) + d * (m * j - i * n))
+        out.n = det * (i * (n * c - b * o) + m * (b * k - j * c) + a * (j * o - n * k))
+        out.c = det * (n * (c * h - g * d) + b * (g * p - o * h) + f * (o * d - c * p))
+        out.g = det * (o * (a * h - e * d) + c * (e * p - m * h) + g * (m * d - a * p))
+        out.k = det * (p * (a * f - e * b) + d * (e * n - m * f) + h * (m * b - a * n))
+        out.o = det * (m * (f * c - b * g) + a * (n * g - f * o) + e * (b * o - n * c))
+        out.d = det * (b * (k * h - g * l) + f * (c * l - k * d) + j * (g * d - c * h))
+        out.h = det * (c * (i * h - e * l) + g * (a * l - i * d) + k * (e * d - a * h))
+        out.l = det * (d * (i * f - e * j) + h * (a * j - i * b) + l * (e * b - a * f))
+        out.p = det * (a * (f * k - j * g) + e * (j * c - b * k) + i * (b * g - f * c))
+        return out
+
+    def set_trs(self, x, y, z, rotz, sx, sy, sz):
+        '''Set to translate(x, y, z).rotatez(rotz).scale(sx, sy, sz)'''
+        s = math.sin(rotz)
+        c = math.cos(rotz)
+        self.a = c * sx
+        self.b = -s * sy
+        self.e = s * sx
+        self.f = c * sy
+        self.k = sz
+        self.d = x
+        self.h = y
+        self.l = z
+        self.c = self.g = self.i = self.j = self.m = self.n = self.o = 0
+        self.p = 1.
+        return self
+
+    def elements_into(self, buf):
+        '''Copy the elements in column-major order into buf, e.g. a
+        ctypes array of 16 floats.'''
+        buf[0] = self.a
+        buf[1] = self.e
+        buf[2] = self.i
+        buf[3] = self.m
+        buf[4] = self.b
+        buf[5] = self.f
+        buf[6] = self.j
+        buf[7] = self.n
+        buf[8] = self.c
+        buf[9] = self.g
+        buf[10] = self.k
+        buf[11] = self.o
+        buf[12] = self.d
+        buf[13] = self.h
+        buf[14] = self.l
+        buf[15] = self.p
+        return buf
+
     # Static constructors
     def new(cls, *values):
         M = cls()
@@ -1284,9 +1513,25 @@ class Matrix4:
 
         return Quaternion(w, x, y, z)
 
-        
+class Matrix4Pool:
+    '''Scratch matrices for per-frame temporaries.
+
+    get() hands out a matrix (set to identity) and release() gives it back,
+    so once the pool has grown to the number of matrices in use at a time
+    no new Matrix4 objects are created.
+    '''
+    def __init__(self, size=4):
+        self._free = [Matrix4() for _ in range(size)]
+
+    def get(self):
+        if self._free:
+            return self._free.pop().identity()
+        return Matrix4()
+
+    def release(self, *matrices):
+        self._free.extend(matrices)
 
-class Quaternion:
+class Quaternion(metaclass=_EuclidMetaclass):
     # All methods and naming conventions based off 
     # http://www.euclideanspace.com/maths/algebra/realNormedAlgebra/quaternions
 
@@ -1615,7 +1860,7 @@ class Quaternion:
 # Much maths thanks to Paul Bourke, http://astronomy.swin.edu.au/~pbourke
 # ---------------------------------------------------------------------------
 
-class Geometry:
+class Geometry(metaclass=_EuclidMetaclass):
     def _connect_unimplemented(self, other):
         raise AttributeError('Cannot connect %s to %s' %
                              (self.__class__, other.__class__))
@@ -2184,7 +2429,7 @@ class Point3(Vector3, Geometry):
         if c:
             return c._swap()
 
-class Line3:
+class Line3(metaclass=_EuclidMetaclass):
     __slots__ = ['p', 'v']
 
     def __init__(self, *args):
@@ -2294,7 +2539,7 @@ class LineSegment3(Line3):
 
     length = property(lambda self: abs(self.v))
 
-class Sphere:
+class Sphere(metaclass=_EuclidMetaclass):
     __slots__ = ['c', 'r']
 
     def __init__(self, center, radius):
@@ -2342,7 +2587,7 @@ class Sphere:
         if c:
             return c
 
-class Plane:
+class Plane(metaclass=_EuclidMetaclass):
     # n.p = k, where n is normal, p is point on plane, k is constant scalar
     __slots__ = ['n', 'k']
 
@@ -1,16 +1,161 @@
-from .euclid import *
-from random import random
+from .euclid import Point3, Vector3
+from . import stats, validate
+from fractions import Fraction
+from functools import wraps
+from math import atan2
+from random import Random, random
+
+# Shewchuk's bound on the rounding error of ccw, relative to the size of
+# its two products
+_CCW_ERROR = (3 + 16 * 2.0 ** -53) * 2.0 ** -53
 
 def ccw(a, b, c):
-    return (b.x - a.x)*(c.y - a.y) - (c.x - a.x)*(b.y - a.y)
+    """Twice the signed area of a, b, c, positive if counter-clockwise
+
+    The sign is exact: a result too close to zero to trust is recomputed
+    with fractions, so points that are almost collinear get the same answer
+    from every test that looks at them.
+    """
+    ax = a.x
+    ay = a.y
+    left = (b.x - ax)*(c.y - ay)
+    right = (c.x - ax)*(b.y - ay)
+    det = left - right
+    if abs(det) >= _CCW_ERROR * (abs(left) + abs(right)):
+        return det
+    ax = Fraction(ax)
+    ay = Fraction(ay)
+    return float((Fraction(b.x) - ax)*(Fraction(c.y) - ay)
+                 - (Fraction(c.x) - ax)*(Fraction(b.y) - ay))
+
+def convex_hull(points):
+    """Return the convex hull of points in counter-clockwise order
+
+    Uses Andrew's monotone chain. Points on the boundary between two
+    corners are kept, so every boundary point ends up on a hull edge.
+    """
+    points = sorted(points, key=lambda p: (p.x, p.y))
+    if len(points) < 3:
+        return points
+
+    def chain(points):
+        result = []
+        for p in points:
+            while len(result) > 1 and ccw(result[-2], result[-1], p) < 0:
+                result.pop()
+            result.append(p)
+        return result
+
+    lower = chain(points)
+    upper = chain(reversed(points))
+    if len(lower) == len(points) and len(upper) == len(points):
+        # all on one line, the hull is the segment between the ends
+        return [points[0], points[-1]]
+    return lower[:-1] + upper[:-1]
+
+def hilbert_index(x, y, order=16):
+    """Return the position of cell (x, y) along a Hilbert curve
+
+    x and y are integers in [0, 2**order).
+    """
+    d = 0
+    s = 1 << (order - 1)
+    while s:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve stays continuous
+        if not ry:
+            if rx:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+def hilbert_sort(points, order=16):
+    """Return points sorted along a Hilbert curve over their bounding box"""
+    if len(points) < 2:
+        return list(points)
+    xs = [p.x for p in points]
+    ys = [p.y for p in points]
+    x0, y0 = min(xs), min(ys)
+    scale = ((1 << order) - 1) / (max(max(xs) - x0, max(ys) - y0) or 1)
+    return sorted(points, key=lambda p: hilbert_index(
+        int((p.x - x0) * scale), int((p.y - y0) * scale), order))
+
+def brio_order(points, seed=None):
+    """Return points in biased randomized insertion order
+
+    Every point goes into the last round with probability 1/2, otherwise
+    into the one before and so on, so the rounds double in size. Each
+    round is Hilbert sorted, which keeps consecutive points close while
+    the rounds keep the order random enough to avoid bad cases.
+    """
+    rand = Random(seed)
+    rounds = [[]]
+    for p in points:
+        r = 0
+        while rand.random() < 0.5 and r < 64:
+            r += 1
+        while len(rounds) <= r:
+            rounds.append([])
+        rounds[r].append(p)
+    result = []
+    for r in reversed(rounds):
+        result += hilbert_sort(r)
+    return result
+
+def convex_ears(polygon):
+    """Return triangles covering a convex counter-clockwise polygon
+
+    The triangles are the ears in the order they are clipped, the last
+    one is what remains. Points on the boundary between two corners are
+    allowed, the triangles never come out flat.
+    """
+    ring = list(polygon)
+    ears = []
+    i = 0
+    while len(ring) > 3:
+        i %= len(ring)
+        n = len(ring)
+        z, a, b, c, d = [ring[(i + k) % n] for k in range(-2, 3)]
+        # only clip strictly convex corners, and not when what is left
+        # would lie on one line
+        if ccw(a, b, c) > 0 and (ccw(z, a, c) > 0 or ccw(a, c, d) > 0):
+            ears.append((a, b, c))
+            del ring[i]
+        else:
+            i += 1
+    ears.append(tuple(ring))
+    return ears
+
+def unique_vertices(points):
+    """Return points as Vertex objects, dropping repeated positions"""
+    # repeated positions can't be triangulated
+    unique = dict()
+    for p in points:
+        if not isinstance(p, Vertex):
+            p = Vertex(*p)
+        unique.setdefault((p.x, p.y), p)
+    return list(unique.values())
 
 class Vertex(Point3):
     def __init__(self, x, y, height):
         super(Point3, self).__init__(x, y, height)
         self.halfedges = []
+        # assigned by the graph the vertex is added to
+        self.id = None
+
+    # ids are only unique within one graph and change when a vertex is
+    # registered, so vertices are keys by identity; the id indexes the
+    # per-vertex tables of the graph
+    __hash__ = object.__hash__
 
-    def __hash__(self):
-        return hash((x, y, height))
+    def __eq__(self, other):
+        if isinstance(other, Vertex):
+            return self is other
+        return super(Vertex, self).__eq__(other)
 
     def add_halfedge(self, new_he):
         assert new_he.twin
@@ -41,7 +186,31 @@ class Vertex(Point3):
             new_he.prev = new_he.twin
             self.halfedges.append(new_he)
 
+    def remove_halfedge(self, he):
+        # the inverse of add_halfedge, when the other end is taken out first
+        if len(self.halfedges) > 1:
+            before, after = he.prev, he.twin.next
+            before.next = after
+            after.prev = before
+        self.halfedges.remove(he)
+
+    def normal(self):
+        # sum of the unnormalized face normals, weighting faces by area
+        normal = Vector3(0, 0, 0)
+        for he in self.halfedges:
+            if he.next.next.next != he:
+                continue
+            n = (he.next.origin - self).cross(he.next.next.origin - self)
+            if n.z > 0:
+                normal += n
+        if normal.z > 0:
+            return normal.normalize()
+        return Vector3(0, 0, 1)
+
 class Halfedge:
+    # one graph has about six per vertex, keep them small
+    __slots__ = ('origin', 'twin', 'prev', 'next')
+
     def __init__(self, origin):
         self.origin = origin
         self.twin = None
@@ -59,41 +228,241 @@ class Halfedge:
             return (self.origin)
         return (self.origin, self.twin.origin)
 
+    def face(self):
+        face = [self]
+        while face[-1].next != self:
+            face.append(face[-1].next)
+        return face
+
+    def is_outer(self):
+        """Return whether this halfedge is on the outer face"""
+        # the only face whose first corner isn't convex
+        a, b = self.origin, self.next
+        return ccw(a, b.origin, b.next.origin) <= 0
+
+def _cross(he, point):
+    # the walk only enters the outer face towards a point beyond the hull
+    twin = he.twin
+    if twin.is_outer():
+        raise ValueError('point is outside the hull')
+    return twin
+
+def _edit(method):
+    # everything a public edit does becomes one journal entry
+    @wraps(method)
+    def edit(self, *args, **kwargs):
+        journal = self.journal
+        if journal is None:
+            return method(self, *args, **kwargs)
+        journal.begin()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            journal.end()
+    return edit
+
 class Graph:
+    # set by journal.Journal to record edits for undo
+    journal = None
+
     def __init__(self, vertices=[]):
-        self.vertices = [
+        # faces crossed by locate() so far
+        self.walk_steps = 0
+        if vertices:
+            self._init_points(vertices)
+            return
+
+        self.vertices = []
+        self.normals = []
+        for corner in [
                 Vertex( 1,  1, random()),
                 Vertex( 1, -1, random()),
                 Vertex(-1, -1, random()),
                 Vertex(-1,  1, random())
-                ]
+                ]:
+            self._register(corner)
         self.add_edge(self.vertices[0], self.vertices[1])
         self.add_edge(self.vertices[1], self.vertices[2])
         self.add_edge(self.vertices[2], self.vertices[3])
         self.add_edge(self.vertices[3], self.vertices[0])
+        self.hull = convex_hull(self.vertices)
         self._active_face = self.vertices[0].halfedges[0]
 
-    def add_vertex(self, vertex):
-        if not self.vertices:
-            raise NotImplemented
+    def _init_points(self, points):
+        points = unique_vertices(points)
+        self.hull = convex_hull(points)
+        if len(self.hull) < 3:
+            raise ValueError('points are colinear')
 
-        first = self._active_face
-        face = [first]
+        for i in range(-1, len(self.hull) - 1):
+            self._link(self.hull[i], self.hull[i+1])
+
+        for a, b, c in convex_ears(self.hull)[:-1]:
+            self._link(a, c)
+
+        self.vertices = []
+        self.normals = []
+        for v in self.hull:
+            self._register(v)
+        self._active_face = self.hull[0].halfedges[0]
+        self.update_normals(self.vertices)
+
+        on_hull = set(self.hull)
+        self.add_vertices([p for p in points if p not in on_hull])
+
+    @classmethod
+    def from_triangles(cls, vertices, triangles):
+        """Build a graph from vertices and counter-clockwise index triples
+
+        The triangles have to cover the convex hull of the vertices, which
+        becomes the outer face. The vertices must not be in another graph.
+        """
+        graph = cls.__new__(cls)
+        graph.walk_steps = 0
+        graph.vertices = []
+        graph.normals = []
+        for v in vertices:
+            graph._register(v)
+
+        edges = dict()
+        for tri in triangles:
+            face = [Halfedge(vertices[i]) for i in tri]
+            for i in range(3):
+                face[i].next = face[(i + 1) % 3]
+                face[(i + 1) % 3].prev = face[i]
+                edges[tri[i], tri[(i + 1) % 3]] = face[i]
+
+        outer = dict()
+        for (u, w), he in list(edges.items()):
+            if he.twin:
+                continue
+            twin = edges.get((w, u))
+            if twin is None:
+                twin = Halfedge(vertices[w])
+                outer[w] = twin
+            he.twin = twin
+            twin.twin = he
+        # the outer face runs clockwise, from w to u and on from u
+        for twin in outer.values():
+            twin.next = outer[twin.twin.origin.id]
+            twin.next.prev = twin
+
+        for he in list(edges.values()) + list(outer.values()):
+            he.origin.halfedges.append(he)
+        for v in graph.vertices:
+            # counter-clockwise, as add_halfedge keeps them
+            v.halfedges.sort(key=lambda he: atan2(he.twin.origin.y - v.y,
+                                                  he.twin.origin.x - v.x))
+
+        graph.hull = convex_hull(graph.vertices)
+        graph._active_face = graph.hull[0].halfedges[0]
+        graph.update_normals(graph.vertices)
+        return graph
+
+    def _register(self, vertex):
+        vertex.id = len(self.vertices)
+        self.vertices.append(vertex)
+        self.normals.append(Vector3(0, 0, 1))
+        if self.journal is not None:
+            self.journal.record(('register', vertex))
+
+    def contains(self, point):
+        """Return whether point is inside the hull or on its boundary"""
+        # binary search for the wedge of the fan around the first corner
+        hull = self.hull
+        first = hull[0]
+        if ccw(first, hull[1], point) < 0 or ccw(first, hull[-1], point) > 0:
+            return False
+        lo, hi = 1, len(hull) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if ccw(first, hull[mid], point) >= 0:
+                lo = mid
+            else:
+                hi = mid
+        return ccw(hull[lo], hull[hi], point) >= 0
+
+    def locate(self, point, start=None):
+        """Return a halfedge of the face containing point
+
+        Raises ValueError if point is outside the hull.
+        """
+        first = start or self._active_face
+        # the starting edge hasn't been crossed yet, so check it as well
+        if ccw(first.origin, first.next.origin, point) < 0:
+            first = _cross(first, point)
         curr = first.next
+        steps = 0
         while first != curr:
-            if ccw(curr.origin, curr.next.origin, vertex) < 0:
-                curr = first = curr.twin
-                self._active_face = curr
-                face = []
-            face.append(curr)
+            if ccw(curr.origin, curr.next.origin, point) < 0:
+                curr = first = _cross(curr, point)
+                steps += 1
             curr = curr.next
+        self.walk_steps += steps
+        if stats.enabled:
+            stats.count('walk_steps', steps)
+        return first
 
+    @_edit
+    def add_vertex(self, vertex):
+        """Connect vertex to the corners of the face it lies in
+
+        A vertex on an edge splits it. Raises ValueError for one outside
+        the hull, on the boundary or at the position of another vertex.
+        """
+        if not self.vertices:
+            raise NotImplemented
+
+        face = self.locate(vertex).face()
+        on_edge = [he for he in face
+                   if ccw(he.origin, he.next.origin, vertex) == 0]
+        if on_edge:
+            face = self._split_face(on_edge, vertex)
         for he in face:
-            self.add_edge(he.origin, vertex)
-        self.vertices.append(vertex)
+            self._link(he.origin, vertex)
+        self._register(vertex)
+        if self.journal is not None:
+            self.journal.record(
+                ('active', self._active_face, vertex.halfedges[0]))
         self._active_face = vertex.halfedges[0]
+        self.update_normals([vertex] + [he.origin for he in face])
+        if stats.enabled:
+            stats.count('vertices_added')
+        if validate.enabled:
+            validate.check_sample(self, [vertex])
+
+    def _split_face(self, on_edge, vertex):
+        # vertex lies on an edge of its face: take the edge out and return
+        # the corners of both triangles it separated, to connect to
+        if len(on_edge) > 1:
+            raise ValueError('vertex is already in the graph')
+        he = on_edge[0]
+        other = he.twin.face()
+        if len(other) != 3 or \
+                ccw(other[0].origin, other[1].origin, other[2].origin) <= 0:
+            raise ValueError('vertex lies on the boundary')
+        corners = he.next.face()[:2] + other[1:]
+        self._unlink(he)
+        return corners
+
+    @_edit
+    def add_vertices(self, vertices, seed=0):
+        """Add every vertex, in an order that keeps the walks short
 
+        Uses a biased randomized insertion order: the vertices are split
+        into rounds of doubling size at random, and each round is sorted
+        along a Hilbert curve so consecutive inserts land near each other
+        and locate() starts next to the target.
+        """
+        for vertex in brio_order(vertices, seed):
+            self.add_vertex(vertex)
+
+    @_edit
     def add_edge(self, u, v):
+        u_he = self._link(u, v)
+        self.update_normals(he.origin for he in u_he.face() + u_he.twin.face())
+
+    def _link(self, u, v):
         u_he = Halfedge(u)
         v_he = Halfedge(v)
 
@@ -102,36 +471,76 @@ class Graph:
 
         u.add_halfedge(u_he)
         v.add_halfedge(v_he)
+        if self.journal is not None:
+            self.journal.record(('link', u_he))
+        return u_he
 
-    def gl_vertices(self):
-        result = []
+    def _unlink(self, u_he):
+        u_he.twin.origin.remove_halfedge(u_he.twin)
+        u_he.origin.remove_halfedge(u_he)
+        if self.journal is not None:
+            self.journal.record(('unlink', u_he))
 
-        seen = []
-        expanded = [self._active_face]
-        while expanded:
-            temp = [expanded.pop()]
+    @_edit
+    def set_height(self, vertex, height):
+        if self.journal is not None:
+            self.journal.record(('height', vertex, vertex.z, height))
+        vertex.z = height
+        self.update_normals([vertex] + [he.twin.origin for he in vertex.halfedges])
 
-            if temp[0] in seen:
-                continue
+    @_edit
+    def update_normals(self, vertices):
+        journal = self.journal
+        for vertex in set(vertices):
+            normal = vertex.normal()
+            if journal is not None:
+                journal.record(('normal', vertex.id,
+                                self.normals[vertex.id], normal))
+            self.normals[vertex.id] = normal
 
-            while temp[-1].next != temp[0]: # ensure we don't redo the same one
-                seen.append(temp[-1])
-                temp.append(temp[-1].next)
-                expanded.append(temp[-1].twin)
+    def faces(self):
+        """Yield the bounded triangles as tuples of their halfedges"""
+        seen = set()
+        for vertex in self.vertices:
+            for he in vertex.halfedges:
+                if he in seen:
+                    continue
 
-            if len(temp) != 3:
-                continue
+                face = he.face()
+                seen.update(face)
+
+                if len(face) != 3:
+                    continue
+                if ccw(face[0].origin, face[1].origin, face[2].origin) <= 0:
+                    continue
+                yield tuple(face)
 
-            temp = [t.origin for t in temp]
-            normal = (temp[0]-temp[2]).cross(temp[1]-temp[0]).normalize()
-            color = [0.4] * 3
+    def gl_vertices(self, smooth=False):
+        # the faces are exported as arrays, one numpy row per corner instead
+        # of Vector3 arithmetic per face; numpy isn't needed to import this
+        import numpy as np
+        from .arrays import Point3Array, Vector3Array
 
-            for t in temp:
-                result += [*t, *normal, *color]
+        corners = [he.origin for face in self.faces() for he in face]
+        positions = Point3Array.from_vectors(corners)
+        if smooth:
+            ids = np.array([v.id for v in corners], dtype=np.intp)
+            normals = Vector3Array.from_vectors(self.normals).data[ids]
+        else:
+            p = positions.data.reshape(-1, 3, 3)
+            a, b, c = [Point3Array(p[:, i]) for i in range(3)]
+            normals = np.repeat((a - c).cross(b - a).normalize().data, 3,
+                                axis=0)
+        rows = np.empty((len(corners), 9))
+        rows[:, :3] = positions.data
+        rows[:, 3:6] = normals
+        rows[:, 6:] = 0.4
+        result = rows.ravel().tolist()
 
         color = [0.4] * 3
-        square = self.vertices[:4]
-        for i in range(-1, 3):
+        # walk the hull clockwise so the skirt normals face outwards
+        square = self.hull[::-1]
+        for i in range(-1, len(square) - 1):
             normal = (square[i] - Vector3(*square[i+1][:2], 0.0)).cross(square[i+1] - Vector3(*square[i+1][:2], 0.0)).normalize()
             result += [*(square[i]), *normal, *color]
             result += [*(square[i][:2]), 0.0, *normal, *color]
@@ -140,5 +549,7 @@ class Graph:
             result += [*(square[i+1][:2]), 0.0, *normal, *color]
             result += [*(square[i+1]), *normal, *color]
 
+        if stats.enabled:
+            stats.count('vertices_exported', len(result) // 9)
         return result
 
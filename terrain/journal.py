@@ -0,0 +1,153 @@
+"""Undo and redo for Graph edits
+
+A Journal attached to a graph records the primitive changes every edit
+makes: linked and unlinked halfedge pairs, registered vertices, heights,
+normals and the face locate() starts from, each with its old and new
+value. One call of add_vertex, add_vertices, add_edge or set_height is
+one entry. Undoing an entry reverts exactly those changes in reverse, and
+redoing replays them on the same objects, so both cost the size of the
+edit rather than the size of the graph.
+
+snapshot() returns a marker for the current state and restore() undoes or
+redoes until the graph is back there. Snapshots are not copy-on-write
+copies of the graph: taking one is free, and restoring one costs time
+linear in the edits made since the marker. A new edit after undo() drops
+the redo history, and with it the snapshots that were only reachable by
+redo.
+
+The geometry worker keeps a journal per graph, so the edits sent to it
+can be undone.
+"""
+
+from .euclid import Vector3
+
+class Journal:
+    """Record the edits of graph; limit bounds how many can be undone"""
+    def __init__(self, graph, limit=None):
+        self.graph = graph
+        self.limit = limit
+        # the first entry stands for the state when recording started
+        self.done = [[]]
+        self.undone = []
+        self._pending = []
+        self._depth = 0
+        graph.journal = self
+
+    def close(self):
+        """Stop recording, the graph keeps its current state
+
+        The history is dropped, later edits would invalidate it anyway.
+        """
+        self.graph.journal = None
+        self.done = [[]]
+        self.undone.clear()
+
+    def begin(self):
+        self._depth += 1
+
+    def end(self):
+        self._depth -= 1
+        if self._depth == 0 and self._pending:
+            self.done.append(self._pending)
+            self._pending = []
+            self.undone.clear()
+            if self.limit is not None and len(self.done) > self.limit + 1:
+                del self.done[:len(self.done) - self.limit - 1]
+
+    def record(self, change):
+        self._pending.append(change)
+        if self._depth == 0:
+            # a primitive change made outside any edit
+            self.begin()
+            self.end()
+
+    def can_undo(self):
+        return len(self.done) > 1
+
+    def can_redo(self):
+        return bool(self.undone)
+
+    def undo(self):
+        """Revert the last edit, return False if there is none"""
+        if self._depth:
+            raise RuntimeError('undo during an edit')
+        if not self.can_undo():
+            return False
+        entry = self.done.pop()
+        for change in reversed(entry):
+            _revert(self.graph, change)
+        self.undone.append(entry)
+        return True
+
+    def redo(self):
+        """Replay the last undone edit, return False if there is none"""
+        if self._depth:
+            raise RuntimeError('redo during an edit')
+        if not self.can_redo():
+            return False
+        entry = self.undone.pop()
+        for change in entry:
+            _apply(self.graph, change)
+        self.done.append(entry)
+        return True
+
+    def snapshot(self):
+        """Return a marker of the current state for restore()"""
+        return self.done[-1]
+
+    def restore(self, snapshot):
+        """Undo or redo until the graph is in the state of snapshot
+
+        Raises ValueError if the snapshot was dropped, by a new edit after
+        undo or by the limit.
+        """
+        if any(entry is snapshot for entry in self.done):
+            while self.done[-1] is not snapshot:
+                self.undo()
+        elif any(entry is snapshot for entry in self.undone):
+            while self.done[-1] is not snapshot:
+                self.redo()
+        else:
+            raise ValueError('snapshot is no longer in the journal')
+
+def _link(he):
+    he.origin.add_halfedge(he)
+    he.twin.origin.add_halfedge(he.twin)
+
+def _unlink(he):
+    he.twin.origin.remove_halfedge(he.twin)
+    he.origin.remove_halfedge(he)
+
+def _apply(graph, change):
+    kind = change[0]
+    if kind == 'link':
+        _link(change[1])
+    elif kind == 'unlink':
+        _unlink(change[1])
+    elif kind == 'register':
+        vertex = change[1]
+        vertex.id = len(graph.vertices)
+        graph.vertices.append(vertex)
+        graph.normals.append(Vector3(0, 0, 1))
+    elif kind == 'height':
+        change[1].z = change[3]
+    elif kind == 'normal':
+        graph.normals[change[1]] = change[3]
+    elif kind == 'active':
+        graph._active_face = change[2]
+
+def _revert(graph, change):
+    kind = change[0]
+    if kind == 'link':
+        _unlink(change[1])
+    elif kind == 'unlink':
+        _link(change[1])
+    elif kind == 'register':
+        graph.vertices.pop().id = None
+        graph.normals.pop()
+    elif kind == 'height':
+        change[1].z = change[2]
+    elif kind == 'normal':
+        graph.normals[change[1]] = change[2]
+    elif kind == 'active':
+        graph._active_face = change[1]
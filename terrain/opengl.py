@@ -1,6 +1,16 @@
-from ctypes import c_char_p, c_char, cast, pointer, POINTER, sizeof, create_string_buffer
+import hashlib
+import os
+import struct
+import time
+from array import array
+from ctypes import c_char_p, c_char, cast, pointer, POINTER, sizeof, create_string_buffer, addressof, memmove
 from pyglet.gl import *
+from pyglet.gl.lib import MissingFunctionException
 from .euclid import *
+from . import stats
+
+# temporaries for the per-frame matrix math
+_scratch = Matrix4Pool()
 
 class Shader:
     def __init__(self, handle):
@@ -8,13 +18,114 @@ class Shader:
         self.uniforms = dict()
 
     def uni(self, var):
-        return self.uniforms.setdefault(
-            var,
-            glGetUniformLocation(self.handle, bytes(var, 'utf8'))
-        )
+        try:
+            return self.uniforms[var]
+        except KeyError:
+            loc = glGetUniformLocation(self.handle, bytes(var, 'utf8'))
+            self.uniforms[var] = loc
+            return loc
+
+    def bind_block(self, name, binding):
+        """Attach the uniform block name to a uniform buffer binding point"""
+        index = glGetUniformBlockIndex(self.handle, bytes(name, 'utf8'))
+        if index != GL_INVALID_INDEX:
+            glUniformBlockBinding(self.handle, index, binding)
 
 class ShaderLoader:
     shaders = dict()
+    # (source or cache, seconds) per loaded program
+    timings = dict()
+    # linked program binaries are kept here between runs, an empty
+    # TERRAIN_SHADER_CACHE or cache_dir disables it
+    cache_dir = os.environ.get('TERRAIN_SHADER_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'terrain', 'shaders'))
+    # whether the context can load program binaries, checked once
+    _binaries = None
+
+    def _have_binaries(cls):
+        # GL 4.1 or ARB_get_program_binary, and at least one format
+        if cls._binaries is None:
+            cls._binaries = False
+            try:
+                if gl_info.have_version(4, 1) or \
+                        gl_info.have_extension('GL_ARB_get_program_binary'):
+                    formats = GLint()
+                    glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS,
+                                  pointer(formats))
+                    cls._binaries = formats.value > 0
+            except (GLException, MissingFunctionException) as e:
+                print("shader cache disabled:", e)
+        return cls._binaries
+    _have_binaries = classmethod(_have_binaries)
+
+    def _cache_key(cls, vpath, fpath):
+        # binaries are only valid for the same sources and the same driver
+        if not cls.cache_dir or not cls._have_binaries():
+            return None
+        digest = hashlib.sha1()
+        for path in (vpath, fpath):
+            with open(path, 'rb') as source:
+                digest.update(source.read())
+        for name in (GL_VENDOR, GL_RENDERER, GL_VERSION):
+            digest.update(cast(glGetString(name), c_char_p).value or b'')
+        return digest.hexdigest()
+    _cache_key = classmethod(_cache_key)
+
+    def _load_binary(cls, key):
+        if not key:
+            return None
+        try:
+            with open(os.path.join(cls.cache_dir, key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) <= 4:
+            return None
+
+        binary_format = struct.unpack('<I', data[:4])[0]
+        binary = create_string_buffer(data[4:], len(data) - 4)
+        shader = glCreateProgram()
+        success = GLint()
+        try:
+            glProgramBinary(shader, binary_format, binary, len(binary))
+            glGetProgramiv(shader, GL_LINK_STATUS, pointer(success))
+        except (GLException, MissingFunctionException) as e:
+            print("shader cache error:", e)
+
+        # the driver refuses binaries it can't use, compile instead
+        if success.value != GL_TRUE:
+            glDeleteProgram(shader)
+            return None
+        return shader
+    _load_binary = classmethod(_load_binary)
+
+    def _save_binary(cls, key, shader):
+        if not key:
+            return
+        length = GLint()
+        written = GLsizei()
+        binary_format = GLenum()
+        try:
+            glGetProgramiv(shader, GL_PROGRAM_BINARY_LENGTH, pointer(length))
+            if length.value < 1:
+                return
+            binary = create_string_buffer(length.value)
+            glGetProgramBinary(shader, length.value, pointer(written),
+                               pointer(binary_format), binary)
+        except (GLException, MissingFunctionException) as e:
+            print("shader cache error:", e)
+            return
+
+        path = os.path.join(cls.cache_dir, key)
+        try:
+            os.makedirs(cls.cache_dir, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(struct.pack('<I', binary_format.value))
+                f.write(binary.raw[:written.value])
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print("shader cache error:", e)
+    _save_binary = classmethod(_save_binary)
 
     def _get_shader(cls, vertpath='3d.vert', fragpath='3d.frag'):
         vpath = "./resources/shaders/" + vertpath
@@ -22,24 +133,35 @@ class ShaderLoader:
         if (vpath, fpath) in cls.shaders:
             return cls.shaders[(vpath, fpath)]
 
-        vshader = cls._load_shader(vpath, GL_VERTEX_SHADER)
-        fshader = cls._load_shader(fpath, GL_FRAGMENT_SHADER)
+        start = time.perf_counter()
+        key = cls._cache_key(vpath, fpath)
+        shader = cls._load_binary(key)
+        source = "cache"
+        if shader is None:
+            source = "source"
+            vshader = cls._load_shader(vpath, GL_VERTEX_SHADER)
+            fshader = cls._load_shader(fpath, GL_FRAGMENT_SHADER)
 
-        shader = glCreateProgram()
-        glAttachShader(shader, vshader)
-        glAttachShader(shader, fshader)
+            shader = glCreateProgram()
+            glAttachShader(shader, vshader)
+            glAttachShader(shader, fshader)
+            if key:
+                glProgramParameteri(shader, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
 
-        glLinkProgram(shader)
+            glLinkProgram(shader)
 
-        success = GLint()
-        glGetProgramiv(shader, GL_LINK_STATUS, pointer(success))
-        if success.value != GL_TRUE:
-            logsize = GLint()
-            glGetProgramiv(shader, GL_INFO_LOG_LENGTH, pointer(logsize))
-            log = create_string_buffer(logsize.value)
-            glGetProgramInfoLog(shader, logsize.value, 0, log)
-            print("link error:", log.value)
+            success = GLint()
+            glGetProgramiv(shader, GL_LINK_STATUS, pointer(success))
+            if success.value != GL_TRUE:
+                logsize = GLint()
+                glGetProgramiv(shader, GL_INFO_LOG_LENGTH, pointer(logsize))
+                log = create_string_buffer(logsize.value)
+                glGetProgramInfoLog(shader, logsize.value, 0, log)
+                print("link error:", log.value)
+            else:
+                cls._save_binary(key, shader)
 
+        success = GLint()
         glValidateProgram(shader)
         glGetProgramiv(shader, GL_VALIDATE_STATUS, pointer(success))
         if success.value != GL_TRUE:
@@ -49,6 +171,11 @@ class ShaderLoader:
             glGetProgramInfoLog(shader, logsize.value, 0, log)
             print("valid error:", log.value)
 
+        elapsed = time.perf_counter() - start
+        cls.timings[(vpath, fpath)] = (source, elapsed)
+        print("shader %s + %s from %s in %.1f ms" % (
+            vertpath, fragpath, source, elapsed * 1000))
+
         s = Shader(shader)
         cls.shaders[(vpath, fpath)] = s
         return s
@@ -77,7 +204,29 @@ class ShaderLoader:
     _load_shader = classmethod(_load_shader)
 
 class Camera:
+    """View and projection state with GL-ready buffers
+
+    The buffers are kept between frames and only refilled after pos, to,
+    up or the projection change. upload() skips programs that already have
+    the current values. With use_ubo() view, proj and viewPos live in one
+    uniform buffer object shared by every program that binds the Camera
+    block (see 3d_ubo.vert), so there is a single upload per change.
+    """
+    UBO_BINDING = 0
+    # std140: mat4 view, mat4 proj, vec4 viewPos
+    _UBO_FLOATS = 16 + 16 + 4
+
     def __init__(self, pos, to, up):
+        self._proj_gl = (GLfloat * 16)()
+        self._view_gl = (GLfloat * 16)()
+        self._view_pos_gl = (GLfloat * 3)()
+        self._ubo = None
+        self._ubo_data = None
+        self._ubo_version = -1
+        # version of the camera each program last received
+        self._uploaded = dict()
+        self.version = 0
+
         self.pos = pos
         self.to  = to
         self.up  = up
@@ -85,6 +234,49 @@ class Camera:
         self.is_persp = False
         self.proj = Matrix4()
 
+    def _changed(self):
+        self.version += 1
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        self._pos = pos.copy()
+        self._view_dirty = True
+        self._changed()
+
+    @property
+    def to(self):
+        return self._to
+
+    @to.setter
+    def to(self, to):
+        self._to = to.copy()
+        self._view_dirty = True
+        self._changed()
+
+    @property
+    def up(self):
+        return self._up
+
+    @up.setter
+    def up(self, up):
+        self._up = up.copy()
+        self._view_dirty = True
+        self._changed()
+
+    @property
+    def proj(self):
+        return self._proj
+
+    @proj.setter
+    def proj(self, proj):
+        self._proj = proj
+        proj.elements_into(self._proj_gl)
+        self._changed()
+
     def set_persp(self, fov, aspect, z_near, z_far):
         self.proj = Matrix4.new_perspective(fov, aspect, z_near, z_far)
         self.is_persp = True
@@ -93,18 +285,70 @@ class Camera:
         self.proj = Matrix4.new_orthographic(scale, aspect, z_near, z_far)
         self.is_persp = False
 
+    def _update_view(self):
+        pos = self._pos
+        view_mat = Matrix4.new_look_at(pos, self._to + pos, self._up)
+        view_mat.elements_into(self._view_gl)
+        self._view_pos_gl[0] = pos.x
+        self._view_pos_gl[1] = pos.y
+        self._view_pos_gl[2] = pos.z
+        self._view_dirty = False
+
     def get_proj(self):
-        proj_gl = (GLfloat * len(self.proj[:]))(*self.proj[:])
-        return proj_gl
+        return self._proj_gl
 
     def get_view(self):
-        view_mat = Matrix4.new_look_at(self.pos, self.to + self.pos, self.up)
-        view_gl  = (GLfloat * len(view_mat[:]))(*view_mat[:])
-        return view_gl
+        if self._view_dirty:
+            self._update_view()
+        return self._view_gl
 
     def get_view_pos(self):
-        view_pos_gl = (GLfloat * len(self.pos[:]))(*self.pos)
-        return view_pos_gl
+        if self._view_dirty:
+            self._update_view()
+        return self._view_pos_gl
+
+    def use_ubo(self, binding=UBO_BINDING):
+        """Keep view, proj and viewPos in a uniform buffer at binding"""
+        self._ubo = GLuint()
+        glGenBuffers(1, pointer(self._ubo))
+        self._ubo_data = (GLfloat * self._UBO_FLOATS)()
+        glBindBuffer(GL_UNIFORM_BUFFER, self._ubo)
+        glBufferData(GL_UNIFORM_BUFFER, sizeof(self._ubo_data), None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glBindBufferBase(GL_UNIFORM_BUFFER, binding, self._ubo)
+        self._ubo_version = -1
+
+    def upload(self, shader):
+        """Send the camera to shader if it changed since the last upload
+
+        shader has to be the program in use. With a uniform buffer the
+        shader argument is ignored, the buffer is shared by all of them.
+        """
+        if self._ubo is not None:
+            if self._ubo_version == self.version:
+                return False
+            data = self._ubo_data
+            base = addressof(data)
+            memmove(base, self.get_view(), 64)
+            memmove(base + 64, self._proj_gl, 64)
+            memmove(base + 128, self._view_pos_gl, 12)
+            glBindBuffer(GL_UNIFORM_BUFFER, self._ubo)
+            glBufferSubData(GL_UNIFORM_BUFFER, 0, sizeof(data), data)
+            glBindBuffer(GL_UNIFORM_BUFFER, 0)
+            self._ubo_version = self.version
+            if stats.enabled:
+                stats.count('buffer_bytes', sizeof(data))
+            return True
+
+        if self._uploaded.get(shader.handle) == self.version:
+            return False
+        glUniformMatrix4fv(shader.uni('view'), 1, GL_FALSE, self.get_view())
+        glUniformMatrix4fv(shader.uni('proj'), 1, GL_FALSE, self._proj_gl)
+        glUniform3fv(shader.uni('viewPos'), 1, self._view_pos_gl)
+        self._uploaded[shader.handle] = self.version
+        if stats.enabled:
+            stats.count('uniform_uploads', 3)
+        return True
 
 class Mesh:
     def __init__(self, shader, vertices=[], pos=Vector3(0, 0, 0), rotz=0, scale=1):
@@ -116,10 +360,58 @@ class Mesh:
         self.vbo = GLuint()
         #self.ebo = GLuint()
 
+        self._model = Matrix4()
+        self._model_gl = (GLfloat * 16)()
+        self._norm_gl = (GLfloat * 16)()
+
         self.pos = pos
         self.rotz = rotz
         self.scale = scale
 
+    # the transform setters only mark the cached matrices as stale, they
+    # are rebuilt on the next draw. pos is copied, assign a new vector to
+    # move the mesh instead of changing its components
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        self._pos = pos.copy()
+        self._dirty = True
+
+    @property
+    def rotz(self):
+        return self._rotz
+
+    @rotz.setter
+    def rotz(self, rotz):
+        self._rotz = rotz
+        self._dirty = True
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, scale):
+        self._scale = scale
+        self._dirty = True
+
+    def _update_matrices(self):
+        pos, scale = self._pos, self._scale
+        model_mat = self._model.set_trs(pos.x, pos.y, pos.z, self._rotz,
+                                        scale, scale, scale)
+        model_mat.elements_into(self._model_gl)
+
+        norm_mat = model_mat.inverse_into(_scratch.get())
+        norm_mat.transpose()
+        norm_mat.elements_into(self._norm_gl)
+        _scratch.release(norm_mat)
+        self._dirty = False
+        if stats.enabled:
+            stats.count('matrix_updates')
+
     def _setup_gl(self):
         if not self.vertices:
             return
@@ -133,11 +425,20 @@ class Mesh:
 
     def set_vertices(self, vertices):
         self.vertices = vertices
+        if not self.glsetup:
+            # uploaded by the first draw
+            return
         glBindVertexArray(self.vao)
 
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        verts_gl = (GLfloat * len(self.vertices))(*self.vertices)
+        if isinstance(vertices, array):
+            # already packed floats, e.g. from the geometry worker
+            verts_gl = (GLfloat * len(vertices)).from_buffer(vertices)
+        else:
+            verts_gl = (GLfloat * len(vertices))(*vertices)
         glBufferData(GL_ARRAY_BUFFER, sizeof(verts_gl), verts_gl, GL_STATIC_DRAW)
+        if stats.enabled:
+            stats.count('buffer_bytes', sizeof(verts_gl))
         # position
         glEnableVertexAttribArray(0)
         glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 9 * sizeof(GLfloat), 0)
@@ -158,16 +459,13 @@ class Mesh:
 
         glBindVertexArray(self.vao)
 
-        model_mat = Matrix4()\
-                .translate(*self.pos)\
-                .rotatez(self.rotz)\
-                .scale(*((self.scale,) * 3))
-        model_gl = (GLfloat * len(model_mat[:]))(*model_mat[:])
-        glUniformMatrix4fv(self.shader.uni('model'), 1, GL_FALSE, model_gl)
-
-        norm_mat = model_mat.inverse().transposed()
-        norm_gl  = (GLfloat * len(norm_mat[:]))(*norm_mat[:])
-        glUniformMatrix4fv(self.shader.uni('norm'), 1, GL_FALSE, norm_gl)
+        if self._dirty:
+            self._update_matrices()
+        glUniformMatrix4fv(self.shader.uni('model'), 1, GL_FALSE, self._model_gl)
+        glUniformMatrix4fv(self.shader.uni('norm'), 1, GL_FALSE, self._norm_gl)
         glDrawArrays(GL_TRIANGLES, 0, len(self.vertices)//9)
+        if stats.enabled:
+            stats.count('draw_calls')
+            stats.count('triangles_drawn', len(self.vertices)//27)
 
         glBindVertexArray(0)
@@ -0,0 +1,103 @@
+"""Vertex coordinates shared between graphs
+
+A VertexPool keeps the positions of a point set in three array('d')
+columns, one float per coordinate instead of a Point3 and three float
+objects per vertex. Graphs built from the same pool only own their
+topology: pool.vertices() hands out fresh PooledVertex objects that carry
+the halfedges and graph id of one graph and read their position from the
+pool by key. So comparing triangulations of one point set, e.g. Graph
+against delaunay, stores the coordinates once.
+
+Heights are shared as well. Setting z through one graph moves the vertex
+in every graph of the pool; each graph only updates its own normals, the
+others need update_normals on the vertex and its neighbours, as the
+geometry worker does.
+"""
+
+from array import array
+
+from .geometry import Vertex
+
+class VertexPool:
+    """Columnar x, y, z storage addressed by integer key"""
+    def __init__(self, points=()):
+        self.xs = array('d')
+        self.ys = array('d')
+        self.zs = array('d')
+        self.extend(points)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, key):
+        return (self.xs[key], self.ys[key], self.zs[key])
+
+    def add(self, x, y, z):
+        """Store a position and return its key"""
+        self.xs.append(x)
+        self.ys.append(y)
+        self.zs.append(z)
+        return len(self.xs) - 1
+
+    def extend(self, points):
+        """Store (x, y, z) positions and return the range of their keys"""
+        start = len(self.xs)
+        for x, y, z in points:
+            self.xs.append(x)
+            self.ys.append(y)
+            self.zs.append(z)
+        return range(start, len(self.xs))
+
+    def vertices(self, keys=None):
+        """Return new vertices for one graph, all of them by default"""
+        if keys is None:
+            keys = range(len(self.xs))
+        return [PooledVertex(self, key) for key in keys]
+
+class PooledVertex(Vertex):
+    """A Vertex whose position lives in a VertexPool
+
+    Only the topology is per graph. The x, y and z slots of Point3 are left
+    empty, the properties below take their place.
+    """
+    __slots__ = ('pool', 'key')
+
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+        self.halfedges = []
+        # assigned by the graph the vertex is added to
+        self.id = None
+
+    @property
+    def x(self):
+        return self.pool.xs[self.key]
+
+    @x.setter
+    def x(self, value):
+        self.pool.xs[self.key] = value
+
+    @property
+    def y(self):
+        return self.pool.ys[self.key]
+
+    @y.setter
+    def y(self, value):
+        self.pool.ys[self.key] = value
+
+    @property
+    def z(self):
+        return self.pool.zs[self.key]
+
+    @z.setter
+    def z(self, value):
+        self.pool.zs[self.key] = value
+
+    def __copy__(self):
+        # a detached vertex, not another view of the same key
+        return Vertex(self.x, self.y, self.z)
+
+    copy = __copy__
+
+    def __reduce__(self):
+        return (PooledVertex, (self.pool, self.key), self.__dict__)
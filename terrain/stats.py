@@ -0,0 +1,109 @@
+"""Counters and timers the geometry, opengl and main modules report into
+
+Everything is a no-op until enable() is called. Call sites guard their
+reporting with `if stats.enabled:` so the disabled cost is one global
+lookup; timer() hands out a shared do-nothing context manager.
+
+Values are collected per frame: count() and timer() add to the current
+frame and frame() closes it, keeping the last `window` frames around for
+summary(), report() and dump().
+"""
+
+import time
+from collections import deque
+
+enabled = False
+
+_frames = deque(maxlen=120)
+_current = dict()
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        count(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_timer = _NullTimer()
+
+def enable(window=120):
+    """Start recording, keeping the last window frames"""
+    global enabled, _frames
+    _frames = deque(_frames, maxlen=window)
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    _frames.clear()
+    _current.clear()
+
+def count(name, value=1):
+    """Add value to the counter name of the current frame"""
+    if enabled:
+        _current[name] = _current.get(name, 0) + value
+
+def timer(name):
+    """Context manager adding the seconds spent inside it to name"""
+    if enabled:
+        return _Timer(name)
+    return _null_timer
+
+def frame():
+    """Close the current frame and start a new one"""
+    if enabled:
+        _frames.append(dict(_current))
+        _current.clear()
+
+def summary():
+    """Return {name: {'mean', 'max', 'last'}} over the recorded frames
+
+    Frames that didn't report a name count as 0 for it.
+    """
+    names = set()
+    for f in _frames:
+        names.update(f)
+    result = dict()
+    for name in sorted(names):
+        values = [f.get(name, 0) for f in _frames]
+        result[name] = {
+            'mean': sum(values) / len(values),
+            'max': max(values),
+            'last': values[-1],
+        }
+    return result
+
+def report():
+    """Return summary() as a table"""
+    lines = ["%-24s %12s %12s %12s (%d frames)" % (
+        'stat', 'mean', 'max', 'last', len(_frames))]
+    for name, s in summary().items():
+        lines.append("%-24s %12.6g %12.6g %12.6g" % (
+            name, s['mean'], s['max'], s['last']))
+    return "\n".join(lines)
+
+def dump(path):
+    """Write the recorded frames and their summary to path as JSON"""
+    # json costs more to import than everything else in geometry
+    import json
+    with open(path, 'w') as f:
+        json.dump({'frames': list(_frames), 'summary': summary()}, f,
+                  indent=2)
@@ -0,0 +1,224 @@
+"""Consistency checks of the halfedge structure
+
+problems() exports the topology of a graph to integer arrays, one entry
+per halfedge, and checks every invariant Graph relies on with numpy in a
+single linear pass:
+
+- twins are distinct halfedges pointing back at each other,
+- next and prev are inverse, so every face is a closed cycle,
+- a halfedge ends where its next one starts,
+- each vertex keeps its halfedges counter-clockwise, he.prev.twin being
+  the one after he,
+- bounded faces are counter-clockwise triangles and the only other face is
+  the clockwise outer face.
+
+A broken link usually shows up much later as locate() or face() going
+round forever, this points at it instead.
+
+The sampled mode is meant to stay on while the program runs. Once
+enable() is called, Graph.add_vertex checks the rings of the new vertex
+and of a few random ones, and raises ValueError at the first edit that
+breaks something. Call sites guard it with `if validate.enabled:`.
+"""
+
+from collections import namedtuple
+from random import Random
+
+enabled = False
+samples = 0
+_rand = Random()
+
+Topology = namedtuple('Topology',
+                      'positions origin owner twin next prev after')
+Topology.__doc__ = """Halfedge arrays of a graph
+
+positions is (V, 2), the other fields are int arrays with one entry per
+halfedge: the id of its origin and of the vertex listing it, and the
+indices of the twin, next and prev halfedges and of the one after it
+around its origin. -1 marks a link to a halfedge no vertex lists, or an
+origin the graph doesn't know.
+"""
+
+def enable(sample_size=1, seed=None):
+    """Check sample_size random vertices around every insertion"""
+    global enabled, samples
+    samples = sample_size
+    _rand.seed(seed)
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def export(graph):
+    """Return the Topology of graph"""
+    # numpy is only needed for the full check, not to import geometry
+    import numpy as np
+
+    halfedges = []
+    owner = []
+    after = []
+    for v in graph.vertices:
+        start = len(halfedges)
+        ring = v.halfedges
+        halfedges += ring
+        owner += [v.id] * len(ring)
+        after += [start + (j + 1) % len(ring) for j in range(len(ring))]
+    index = dict((he, i) for i, he in enumerate(halfedges))
+    get = index.get
+    vertices = graph.vertices
+
+    def links(attr):
+        return np.array([get(getattr(he, attr), -1) for he in halfedges],
+                        dtype=np.intp)
+
+    def origin(he):
+        v = he.origin
+        if v.id is None or v.id >= len(vertices) or vertices[v.id] is not v:
+            return -1
+        return v.id
+
+    return Topology(
+        np.array([(v.x, v.y) for v in vertices], dtype=float).reshape(-1, 2),
+        np.array([origin(he) for he in halfedges], dtype=np.intp),
+        np.array(owner, dtype=np.intp),
+        links('twin'), links('next'), links('prev'),
+        np.array(after, dtype=np.intp))
+
+def problems(graph):
+    """Return a list of what is wrong with graph, empty if nothing is"""
+    import numpy as np
+
+    t = export(graph)
+    found = []
+    _report(found, t.origin != t.owner,
+            'halfedges listed by a vertex they do not start at')
+    n = len(t.origin)
+    if n == 0:
+        return found
+    ids = np.arange(n)
+    for name in ('twin', 'next', 'prev'):
+        missing = (getattr(t, name) < 0).sum()
+        if missing:
+            found.append('%d %s links to unlisted halfedges' % (missing, name))
+    if found:
+        # the remaining checks index through the links
+        return found
+
+    origin, twin, nxt, prev = t.origin, t.twin, t.next, t.prev
+    _report(found, twin == ids, 'halfedges are their own twin')
+    _report(found, twin[twin] != ids, 'twins do not point back')
+    _report(found, nxt[prev] != ids, 'prev.next is not the halfedge')
+    _report(found, prev[nxt] != ids, 'next.prev is not the halfedge')
+    _report(found, origin[twin] != origin[nxt],
+            'halfedges end where their next one does not start')
+    _report(found, twin[prev] != t.after,
+            'vertex rings are out of order')
+    if found:
+        return found
+
+    # next is a permutation now, so every face is a closed cycle
+    p = t.positions
+    a, b, c = p[origin], p[origin[nxt]], p[origin[nxt[nxt]]]
+    left = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1])
+    right = (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])
+    area = left - right
+    triangle = nxt[nxt[nxt]] == ids
+    # slivers whose sign the rounding may have flipped get the exact ccw()
+    from .geometry import _CCW_ERROR, ccw
+    vertices = graph.vertices
+    unsure = np.abs(area) < _CCW_ERROR * (np.abs(left) + np.abs(right))
+    for i in np.flatnonzero(triangle & unsure):
+        area[i] = ccw(vertices[origin[i]], vertices[origin[nxt[i]]],
+                      vertices[origin[nxt[nxt[i]]]])
+    inner = triangle & (area > 0)
+    outer = np.flatnonzero(~inner)
+    if len(outer):
+        face = _face(outer[0], nxt, len(outer))
+        if len(face) != len(outer):
+            found.append('%d halfedges on faces that are neither inner '
+                         'triangles nor the outer face'
+                         % (len(outer) - len(face)))
+        else:
+            x, y = p[origin[face]].T
+            if (x * np.roll(y, -1) - np.roll(x, -1) * y).sum() >= 0:
+                found.append('the outer face is not clockwise')
+    else:
+        found.append('there is no outer face')
+
+    faces = inner.sum() // 3 + 1
+    euler = len(graph.vertices) - n // 2 + faces
+    if not found and euler != 2:
+        found.append('V - E + F is %d' % euler)
+    return found
+
+def check(graph):
+    """Raise ValueError if problems() finds anything"""
+    found = problems(graph)
+    if found:
+        raise ValueError('invalid graph: ' + '; '.join(found))
+
+def check_sample(graph, vertices=()):
+    """Check the rings of vertices and of `samples` random vertices
+
+    Only the faces around them are walked, so this costs about the same
+    as one insertion. Raises ValueError.
+    """
+    sample = list(vertices)
+    if graph.vertices:
+        sample += [_rand.choice(graph.vertices) for i in range(samples)]
+    # only a broken face can be longer than this
+    limit = len(graph.vertices)
+    for v in sample:
+        ring = v.halfedges
+        for he, following in zip(ring, ring[1:] + ring[:1]):
+            message = _check_halfedge(v, he, following, limit)
+            if message:
+                raise ValueError('invalid graph at vertex %s: %s'
+                                 % (v.id, message))
+
+def _check_halfedge(v, he, following, limit):
+    # geometry imports this module
+    from .geometry import ccw
+    if he.origin is not v:
+        return 'listed halfedge starts elsewhere'
+    twin = he.twin
+    if twin is None or twin is he or twin.twin is not he:
+        return 'twins do not point back'
+    if he.next is None or he.prev is None or \
+            he.next.prev is not he or he.prev.next is not he:
+        return 'next and prev are not inverse'
+    if he.next.origin is not twin.origin:
+        return 'halfedge ends where its next one does not start'
+    if he.prev.twin is not following:
+        return 'ring is out of order'
+
+    face = [he]
+    while face[-1].next is not he:
+        if len(face) > limit:
+            return 'face does not close'
+        face.append(face[-1].next)
+    if len(face) == 3 and ccw(*[e.origin for e in face]) > 0:
+        return None
+    area = 0
+    for e in face:
+        a, b = e.origin, e.next.origin
+        area += a.x * b.y - b.x * a.y
+    # the outer face is the only clockwise one
+    if area < 0:
+        return None
+    return 'face of %d corners is not a counter-clockwise triangle or ' \
+        'the outer face' % len(face)
+
+def _face(start, nxt, limit):
+    face = [start]
+    i = nxt[start]
+    while i != start and len(face) <= limit:
+        face.append(i)
+        i = nxt[i]
+    return face
+
+def _report(found, mask, message):
+    count = mask.sum()
+    if count:
+        found.append('%d %s' % (count, message))
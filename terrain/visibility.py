@@ -0,0 +1,142 @@
+from heapq import heappop, heappush
+from math import atan2, ceil, cos, floor, hypot, pi, sin
+
+from .geometry import ccw
+
+def line_of_sight(graph, a, b, start=None):
+    """Return whether b is visible from a over the terrain of graph
+
+    Raises ValueError if a or b is outside the hull of graph.
+    """
+    visible, _ = _walk(graph, a, b, start)
+    return visible
+
+def lines_of_sight(graph, pairs):
+    """Return line_of_sight for each (a, b) in pairs
+
+    Each walk starts from the face the previous one began in, so grouping
+    queries by their first point keeps the point location short.
+    """
+    result = []
+    start = None
+    for a, b in pairs:
+        visible, start = _walk(graph, a, b, start)
+        result.append(visible)
+    return result
+
+def _walk(graph, a, b, start):
+    # walk the faces crossed by the projection of ab, comparing the terrain
+    # height on every crossed edge against the height of the sight line
+    if not graph.contains(b):
+        raise ValueError('target is outside the hull')
+    first = graph.locate(a, start)
+    he = first
+    for _ in range(2 * len(graph.vertices) + 8):
+        if he.is_outer():
+            # b is inside, so only rounding leads here
+            return True, first
+
+        # only the square of Graph() before its first insert isn't a
+        # triangle
+        face = (he, he.next, he.next.next) if he.next.next.next is he \
+            else he.face()
+        exit_he = None
+        for e in face:
+            p, q = e.origin, e.next.origin
+            if ccw(p, q, b) < 0 and ccw(a, b, p) <= 0 and ccw(a, b, q) > 0:
+                exit_he = e
+                break
+        if exit_he is None:
+            # b is inside the current face
+            return True, first
+
+        p, q = exit_he.origin, exit_he.next.origin
+        sa, sb = ccw(p, q, a), ccw(p, q, b)
+        sp, sq = ccw(a, b, p), ccw(a, b, q)
+        u = sa / (sa - sb)
+        t = sp / (sp - sq)
+        terrain = p.z + t * (q.z - p.z)
+        sight = a.z + u * (b.z - a.z)
+        if terrain > sight:
+            return False, first
+        he = exit_he.twin
+    return True, first
+
+def viewshed(graph, observer, bins=360):
+    """Return the faces of graph visible from observer
+
+    A horizon of the steepest elevation slope seen so far is swept outwards
+    along the centre ray of each of `bins` angular sectors around the
+    observer. Faces are sampled where they cross those rays (or at their
+    corners when they fall between two rays) and are visible if any sample
+    reaches the horizon of its sector.
+    """
+    ox, oy, oz = observer.x, observer.y, observer.z
+    width = 2 * pi / bins
+    rays = [(cos((i + 0.5) * width - pi), sin((i + 0.5) * width - pi))
+            for i in range(bins)]
+
+    faces = list(graph.faces())
+    visible = [False] * len(faces)
+    sectors = [[] for _ in range(bins)]
+    for n, face in enumerate(faces):
+        pts = [he.origin for he in face]
+        if all(ccw(pts[i], pts[(i + 1) % 3], observer) >= 0
+               for i in range(3)):
+            # the ground under the observer is always seen
+            visible[n] = True
+            continue
+
+        mid = atan2(sum(p.y for p in pts) / 3 - oy,
+                    sum(p.x for p in pts) / 3 - ox)
+        offsets = [(atan2(p.y - oy, p.x - ox) - mid + pi) % (2 * pi) - pi
+                   for p in pts]
+        lo = int(ceil((mid + min(offsets) + pi) / width - 0.5))
+        hi = int(floor((mid + max(offsets) + pi) / width - 0.5))
+
+        if lo > hi:
+            # too thin to cross a ray, fall back to sampling the corners
+            i = int(floor((mid + pi) / width)) % bins
+            dists = [hypot(p.x - ox, p.y - oy) for p in pts]
+            top = max((p.z - oz) / d for p, d in zip(pts, dists))
+            sectors[i].append((min(dists), max(dists), top, n))
+            continue
+
+        for i in range(lo, hi + 1):
+            i %= bins
+            dx, dy = rays[i]
+            near = far = top = None
+            for e in face:
+                p, q = e.origin, e.next.origin
+                ex, ey = q.x - p.x, q.y - p.y
+                denom = dx * ey - dy * ex
+                if not denom:
+                    continue
+                px, py = p.x - ox, p.y - oy
+                t = (px * dy - py * dx) / denom
+                r = (px * ey - py * ex) / denom
+                if 0 <= t <= 1 and r > 0:
+                    slope = (p.z + t * (q.z - p.z) - oz) / r
+                    if near is None or r < near:
+                        near = r
+                    if far is None or r > far:
+                        far = r
+                    if top is None or slope > top:
+                        top = slope
+            if near is not None:
+                sectors[i].append((near, far, top, n))
+
+    for samples in sectors:
+        # a sample is only occluded by the ones that end before it starts;
+        # faces never overlap along a ray, so for ray samples that is all
+        # the ones closer to the observer
+        samples.sort(key=lambda sample: sample[0])
+        horizon = float('-inf')
+        pending = []
+        for near, far, slope, n in samples:
+            while pending and pending[0][0] <= near * (1 + 1e-9):
+                horizon = max(horizon, heappop(pending)[1])
+            if slope >= horizon:
+                visible[n] = True
+            heappush(pending, (far, slope))
+    return [face for face, seen in zip(faces, visible) if seen]
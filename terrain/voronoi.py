@@ -0,0 +1,178 @@
+"""Voronoi cells of the graph vertices, as the dual of the triangulation
+
+The cell of a vertex is the polygon through the circumcenters of the
+triangles around it, in the order the halfedges already keep them. Cells
+are clipped to the convex hull, so together they tile the same domain as
+the triangles. This is only the Voronoi diagram when the graph is a
+Delaunay triangulation, see delaunay.delaunay.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+class Cells(namedtuple('Cells', 'points offsets indices')):
+    """Cell polygons in compressed rows
+
+    The corners of the cell of vertex i are points[indices[offsets[i]:
+    offsets[i + 1]]], counter-clockwise. points is an (M, 2) float array.
+    """
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def cell(self, i):
+        return self.points[self.indices[self.offsets[i]:self.offsets[i + 1]]]
+
+    def areas(self):
+        """Return the area of every cell"""
+        x, y = self.points[self.indices].T
+        # shoelace over each row, the next corner wraps around per row
+        nxt = np.arange(1, len(self.indices) + 1)
+        ends = self.offsets[1:] - 1
+        nxt[ends] = self.offsets[:-1]
+        cross = x * y[nxt] - x[nxt] * y
+        return np.add.reduceat(cross, self.offsets[:-1]) / 2 \
+            if len(cross) else np.zeros(len(self))
+
+def circumcenters(corners):
+    """Return the circumcenters of an (F, 3, 2) array of triangles"""
+    a, b, c = corners[:, 0], corners[:, 1], corners[:, 2]
+    b = b - a
+    c = c - a
+    bb = (b * b).sum(axis=1)
+    cc = (c * c).sum(axis=1)
+    d = 2 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+    x = (c[:, 1] * bb - b[:, 1] * cc) / d
+    y = (b[:, 0] * cc - c[:, 0] * bb) / d
+    return a + np.stack((x, y), axis=1)
+
+def voronoi(graph):
+    """Return the Cells of every vertex of graph, clipped to its hull"""
+    faces = list(graph.faces())
+    face_of = dict()
+    for n, face in enumerate(faces):
+        for he in face:
+            face_of[he] = n
+    corners = np.array([[(he.origin.x, he.origin.y) for he in face]
+                        for face in faces], dtype=float).reshape(-1, 3, 2)
+    centers = circumcenters(corners)
+
+    hull = [(v.x, v.y) for v in graph.hull]
+    outside = np.zeros(len(centers), dtype=bool)
+    for i in range(len(hull)):
+        (x0, y0), (x1, y1) = hull[i - 1], hull[i]
+        outside |= (x1 - x0) * (centers[:, 1] - y0) < \
+            (centers[:, 0] - x0) * (y1 - y0)
+
+    points = [centers]
+    extra = []
+    offsets = [0]
+    indices = []
+    base = len(centers)
+    for v in graph.vertices:
+        ring = [face_of.get(he) for he in v.halfedges]
+        if None not in ring and not any(outside[f] for f in ring):
+            indices += ring
+            offsets.append(len(indices))
+            continue
+
+        # on the hull or reaching past it: build the polygon and clip it
+        # against the hull edges its corners are outside of, the rest of
+        # the hull can't cut a convex polygon
+        polygon = [tuple(centers[f]) if f is not None else None
+                   for f in ring]
+        if None in polygon:
+            # a hull vertex, its cell is open towards the outer face along
+            # the bisectors of the two hull edges at v; inside the hull it
+            # ends where they meet the edges, or at once when the last
+            # circumcenter is already past the edge
+            k = polygon.index(None)
+            after = v.halfedges[(k + 1) % len(ring)].twin.origin
+            before = v.halfedges[k].twin.origin
+            after, before, here = (after.x, after.y), (before.x, before.y), \
+                (v.x, v.y)
+            polygon = polygon[k + 1:] + polygon[:k]
+            first, last = polygon[0], polygon[-1]
+            if _side(here, after, first) > 0:
+                polygon.insert(0, _middle(here, after))
+            if _side(before, here, last) > 0:
+                polygon.append(_middle(before, here))
+            polygon.append(here)
+        edges = set()
+        for p in polygon:
+            edges.update(_beyond(hull, p))
+        for p in _clip(polygon, hull, sorted(edges)):
+            indices.append(base + len(extra))
+            extra.append(p)
+        offsets.append(len(indices))
+
+    if extra:
+        points.append(np.array(extra, dtype=float))
+    return Cells(np.concatenate(points),
+                 np.array(offsets, dtype=np.intp),
+                 np.array(indices, dtype=np.intp))
+
+def _middle(a, b):
+    return ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)
+
+def _side(a, b, p):
+    # ccw() on (x, y) tuples
+    return (b[0] - a[0]) * (p[1] - a[1]) - (p[0] - a[0]) * (b[1] - a[1])
+
+def _beyond(hull, p):
+    # the edges i, from hull[i - 1] to hull[i], that p is outside of; they
+    # are one run, the first is found by binary search over the fan around
+    # hull[0] and the run is followed from there in both directions
+    n = len(hull)
+    first = hull[0]
+    if _side(hull[-1], first, p) < 0:
+        seed = 0
+    elif _side(first, hull[1], p) < 0:
+        seed = 1
+    else:
+        lo, hi = 1, n - 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if _side(first, hull[mid], p) >= 0:
+                lo = mid
+            else:
+                hi = mid
+        if _side(hull[lo], hull[hi], p) >= 0:
+            return []
+        seed = hi
+    run = [seed]
+    i = (seed - 1) % n
+    while len(run) < n and _side(hull[i - 1], hull[i], p) < 0:
+        run.append(i)
+        i = (i - 1) % n
+    i = (seed + 1) % n
+    while len(run) < n and _side(hull[i - 1], hull[i], p) < 0:
+        run.append(i)
+        i = (i + 1) % n
+    return run
+
+def _clip(polygon, hull, edges):
+    # Sutherland-Hodgman against the given edges of the counter-clockwise
+    # hull
+    for i in edges:
+        a, b = hull[i - 1], hull[i]
+        result = []
+        for j in range(len(polygon)):
+            p, q = polygon[j - 1], polygon[j]
+            sp, sq = _side(a, b, p), _side(a, b, q)
+            if sq >= 0:
+                if sp < 0:
+                    result.append(_cross(p, q, sp, sq))
+                result.append(q)
+            elif sp >= 0:
+                result.append(_cross(p, q, sp, sq))
+        polygon = result
+        if not polygon:
+            break
+    return polygon
+
+def _cross(p, q, sp, sq):
+    t = sp / (sp - sq)
+    return (p[0] + t * (q[0] - p[0]), p[1] + t * (q[1] - p[1]))
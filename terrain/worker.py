@@ -0,0 +1,218 @@
+"""Geometry updates in a separate process
+
+The worker process owns the graphs. Edits are sent to it without waiting,
+and it answers with the gl_vertices of every graph they touched as an
+array('f') ready to hand to Mesh.set_vertices. The render loop picks the
+finished buffers up with poll() once per frame and keeps drawing the old
+ones until then, so insertion and export never run on the event thread.
+A process rather than a thread, since the geometry is pure Python and
+would hold the GIL.
+
+The graphs share one VertexPool, so a vertex added to all of them stores
+its position once. Heights are shared as well: setting one moves the
+vertex in every graph that has it, and all of them update their normals
+and send a new buffer.
+
+Every graph records its edits in a Journal. undo() and redo() revert or
+replay the last command in all the graphs it changed, and an edit that
+raises part way is rolled back the same way.
+
+An edit that raises, like a vertex on the boundary or outside the hull,
+leaves its graph as it was and the message is collected in
+GeometryWorker.errors. If the process itself goes away poll() raises
+WorkerError.
+"""
+
+import multiprocessing
+from array import array
+from random import random
+
+from .geometry import Graph
+from .journal import Journal
+from .pool import PooledVertex, VertexPool
+
+# commands that can be undone
+HISTORY = 100
+
+class WorkerError(RuntimeError):
+    pass
+
+def default_graphs():
+    """The pool and the two demo squares on it, split along either diagonal
+
+    The corners are in the order and get the random heights of Graph().
+    """
+    pool = VertexPool([(1, 1, random()), (1, -1, random()),
+                       (-1, -1, random()), (-1, 1, random())])
+    return pool, [
+        Graph.from_triangles(pool.vertices(), [(0, 3, 2), (0, 2, 1)]),
+        Graph.from_triangles(pool.vertices(), [(1, 0, 3), (1, 3, 2)])]
+
+class _Graphs:
+    # the graphs of the worker and, per graph, its vertex at each pool key;
+    # done and undone hold the graphs each command changed, so undo knows
+    # which journals to step back
+    def __init__(self, pool, graphs):
+        self.pool = pool
+        self.graphs = graphs
+        self.keys = [dict((v.key, v) for v in graph.vertices)
+                     for graph in graphs]
+        self.journals = [Journal(graph, HISTORY) for graph in graphs]
+        self.done = []
+        self.undone = []
+
+    def apply(self, name, index, args):
+        """Run one command, return the graphs it changed and the errors"""
+        if name in ('undo', 'redo'):
+            return getattr(self, name)(), []
+        targets = range(len(self.graphs)) if index is None else (index,)
+        if name == 'add_vertex':
+            # one position for every graph the vertex goes into
+            args = (self.pool.add(*args),)
+        elif name == 'set_height' and index is None:
+            # once for all of them, the height is shared anyway
+            targets = (0,)
+        edit = self._EDITS[name]
+        changed = set()
+        errors = []
+        for i in targets:
+            marks = [journal.snapshot() for journal in self.journals]
+            try:
+                changed.update(edit(self, i, *args))
+            except Exception as e:
+                for journal, mark in zip(self.journals, marks):
+                    journal.restore(mark)
+                errors.append('%s%r on graph %d: %s: %s' % (
+                    name, args, i, type(e).__name__, e))
+        if changed:
+            self.done.append(sorted(changed))
+            del self.done[:-HISTORY]
+            del self.undone[:]
+        return changed, errors
+
+    def undo(self):
+        if not self.done:
+            return ()
+        changed = self.done.pop()
+        for i in changed:
+            self.journals[i].undo()
+        self.undone.append(changed)
+        return changed
+
+    def redo(self):
+        if not self.undone:
+            return ()
+        changed = self.undone.pop()
+        for i in changed:
+            self.journals[i].redo()
+        self.done.append(changed)
+        return changed
+
+    def add_vertex(self, i, key):
+        vertex = PooledVertex(self.pool, key)
+        self.graphs[i].add_vertex(vertex)
+        self.keys[i][key] = vertex
+        return (i,)
+
+    def set_height(self, i, vertex_id, height):
+        key = self.graphs[i].vertices[vertex_id].key
+        self.graphs[i].set_height(self.keys[i][key], height)
+        # the pool moved the vertex in the other graphs as well
+        changed = [i]
+        for j, graph in enumerate(self.graphs):
+            vertex = self.keys[j].get(key)
+            # an undone insert leaves the vertex without an id
+            if j != i and vertex is not None and vertex.id is not None:
+                graph.update_normals(
+                    [vertex] + [he.twin.origin for he in vertex.halfedges])
+                changed.append(j)
+        return changed
+
+    _EDITS = {
+        'add_vertex': add_vertex,
+        'set_height': set_height,
+    }
+
+def _serve(conn, factory, smooth):
+    scene = _Graphs(*factory())
+    graphs = scene.graphs
+    changed = set(range(len(graphs)))
+    while True:
+        # apply everything already queued before exporting, so a burst of
+        # edits costs one gl_vertices per graph instead of one per edit
+        while not changed or conn.poll():
+            try:
+                command = conn.recv()
+            except EOFError:
+                return
+            if command is None:
+                return
+            touched, errors = scene.apply(*command)
+            changed.update(touched)
+            for message in errors:
+                conn.send((None, message))
+
+        for i in sorted(changed):
+            conn.send((i, array('f', graphs[i].gl_vertices(smooth))))
+        changed.clear()
+
+class GeometryWorker:
+    """Handle to a process running the graphs made by factory
+
+    factory returns a VertexPool and graphs of its vertices, and has to be
+    a module level function so it can be sent to the worker. index picks
+    the graph an edit applies to, None means all.
+    """
+    def __init__(self, factory=default_graphs, smooth=False):
+        # messages of the edits that failed, for the caller to report
+        self.errors = []
+        context = multiprocessing.get_context('spawn')
+        self._conn, child = context.Pipe()
+        self._process = context.Process(
+            target=_serve, args=(child, factory, smooth), daemon=True)
+        self._process.start()
+        child.close()
+
+    def add_vertex(self, x, y, z, index=None):
+        self._conn.send(('add_vertex', index, (x, y, z)))
+
+    def set_height(self, vertex_id, height, index=None):
+        self._conn.send(('set_height', index, (vertex_id, height)))
+
+    def undo(self):
+        """Revert the last edit that changed anything, if there is one"""
+        self._conn.send(('undo', None, ()))
+
+    def redo(self):
+        self._conn.send(('redo', None, ()))
+
+    def poll(self, timeout=0):
+        """Return {graph index: vertex buffer} of the finished exports
+
+        Only the newest buffer of each graph is kept. Waits up to timeout
+        seconds for the first message, None waits for as long as it takes.
+        Raises WorkerError if the worker process is gone.
+        """
+        ready = dict()
+        try:
+            if self._conn.poll(timeout):
+                while True:
+                    index, buf = self._conn.recv()
+                    if index is None:
+                        self.errors.append(buf)
+                    else:
+                        ready[index] = buf
+                    if not self._conn.poll():
+                        break
+        except (EOFError, OSError):
+            raise WorkerError('geometry worker exited with code %s'
+                              % self._process.exitcode)
+        return ready
+
+    def close(self):
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(5)
+        self._conn.close()
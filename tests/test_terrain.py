@@ -1,5 +1,14 @@
 from terrain.euclid import *
 from terrain.geometry import *
+from terrain.visibility import *
+from terrain.contour import *
+from terrain.arrays import *
+from terrain.delaunay import *
+from terrain.voronoi import *
+from terrain.pool import *
+from terrain.journal import *
+from terrain import bench, stats, validate, worker
+from random import Random
 import pytest
 
 def test_ccw_ccw():
@@ -11,6 +20,44 @@ def test_ccw_cw():
 def test_ccw_colinear():
     assert ccw(Vector3(0, 0, 0), Vector3(0, 1, 0), Vector3(0, 2, 0)) == 0
 
+def test_exact_predicates():
+    from fractions import Fraction
+    from itertools import permutations
+
+    def sign(x):
+        return (x > 0) - (x < 0)
+
+    def exact_ccw(a, b, c):
+        (ax, ay), (bx, by), (cx, cy) = [(Fraction(p.x), Fraction(p.y))
+                                        for p in (a, b, c)]
+        return (bx - ax) * (cy - ay) - (cx - ax) * (by - ay)
+
+    # points a float rounding away from one line
+    rand = Random(3)
+    line = [Vector3(x, 0.3 * x + 0.1, 0)
+            for x in (rand.uniform(-1, 1) for i in range(30))]
+    for a, b, c in zip(line, line[1:], line[2:]):
+        for p, q, r in permutations((a, b, c)):
+            assert sign(ccw(p, q, r)) == sign(exact_ccw(p, q, r))
+
+    def exact_incircle(a, b, c, d):
+        (ax, ay), (bx, by), (cx, cy) = [
+            (Fraction(p.x) - Fraction(d.x), Fraction(p.y) - Fraction(d.y))
+            for p in (a, b, c)]
+        return ((ax * ax + ay * ay) * (bx * cy - cx * by)
+                + (bx * bx + by * by) * (cx * ay - ax * cy)
+                + (cx * cx + cy * cy) * (ax * by - bx * ay))
+
+    # squares of points a tenth apart are only cocircular on paper
+    for i in range(10):
+        x, y = 0.1 * i, 0.1 * (i + 3)
+        square = [Vector3(x, y, 0), Vector3(x + 0.1, y, 0),
+                  Vector3(x + 0.1, y + 0.1, 0), Vector3(x, y + 0.1, 0)]
+        for k in range(4):
+            a, b, c, d = square[k:] + square[:k]
+            assert sign(incircle(a, b, c, d)) == \
+                sign(exact_incircle(a, b, c, d))
+
 def test_vertex_add_halfedge_none():
     v = Vertex(1, 2, 3)
     u = Vertex(2, 3, 4)
@@ -124,3 +171,670 @@ def test_graph_add_vertex():
     for i in range(-1, 2):
         assert v.halfedges[i].prev.twin == v.halfedges[i+1]
 
+
+def flat_graph(points):
+    g = Graph()
+    g.add_edge(g.vertices[0], g.vertices[2])
+    for v in g.vertices:
+        g.set_height(v, 0)
+    for p in points:
+        g.add_vertex(Vertex(*p))
+    return g
+
+def test_graph_add_vertex_walk():
+    g = flat_graph([(0.4, 0.3, 0), (-0.5, 0.2, 0), (0.1, -0.6, 0), (0.2, 0.5, 0)])
+    faces = list(g.faces())
+    assert len(faces) == 2 + 2 * 4
+    for face in faces:
+        assert ccw(*[he.origin for he in face]) > 0
+
+def test_graph_locate():
+    g = flat_graph([(0.4, 0.3, 0), (-0.5, 0.2, 0)])
+    p = Vector3(0.5, -0.5, 0)
+    he = g.locate(p)
+    assert he.next.next.next == he
+    for h in (he, he.next, he.next.next):
+        assert ccw(h.origin, h.next.origin, p) >= 0
+
+def test_line_of_sight():
+    g = flat_graph([(0.05, -0.05, 5), (0.5, 0.3, 0), (-0.5, -0.3, 0)])
+    assert not line_of_sight(g, Point3(-0.6, 0.1, 1), Point3(0.6, -0.1, 1))
+    assert line_of_sight(g, Point3(-0.6, 0.1, 10), Point3(0.6, -0.1, 10))
+    assert lines_of_sight(g, [
+        (Point3(0.6, 0.2, 0.1), Point3(0.7, -0.2, 0.1)),
+        (Point3(-0.6, 0.1, 1), Point3(0.6, -0.1, 1)),
+        ]) == [True, False]
+
+    # both ends have to be over the terrain
+    with pytest.raises(ValueError):
+        line_of_sight(g, Point3(2, 0.3, 1), Point3(0, 0, 1))
+    with pytest.raises(ValueError):
+        line_of_sight(g, Point3(0, 0.3, 1), Point3(2, 0.3, 1))
+    with pytest.raises(ValueError):
+        lines_of_sight(g, [(Point3(0.6, 0.2, 1), Point3(0.7, -0.2, 1)),
+                           (Point3(0.6, 0.2, 1), Point3(-0.6, -3, 1))])
+    assert line_of_sight(g, Point3(-0.6, 0.1, 10), Point3(1, 0.5, 10))
+    assert g.contains(Point3(1, 1, 0)) and g.contains(Point3(0.3, -1, 0))
+    assert not g.contains(Point3(1.01, 0, 0))
+
+    square = Graph()
+    for v in square.vertices:
+        square.set_height(v, 0)
+    assert line_of_sight(square, Point3(-0.5, 0.5, 1), Point3(0.5, -0.5, 1))
+
+def test_viewshed():
+    rand = Random(7)
+    g = flat_graph([(rand.uniform(-0.9, 0.9), rand.uniform(-0.9, 0.9), 0)
+                    for i in range(200)])
+    faces = list(g.faces())
+    assert len(viewshed(g, Point3(0.05, 0.02, 1))) == len(faces)
+    for v in g.vertices:
+        if 0.2 < v.x < 0.4:
+            v.z = 1
+    observer = Point3(-0.5, 0.1, 0.2)
+    visible = set(face[0] for face in viewshed(g, observer))
+    assert 0 < len(visible) < len(faces)
+    for face in faces:
+        centroid = sum((he.origin for he in face), Vector3()) * (1 / 3)
+        centroid.z += 1e-9
+        if line_of_sight(g, observer, centroid):
+            assert face[0] in visible
+
+def test_contours():
+    g = flat_graph([(0.05, -0.05, 1), (0.5, 0.3, 0), (-0.5, -0.3, 0)])
+    lines = contours(g, [0.5, 2, 0.25])
+    assert sorted(lines) == [0.25, 0.5, 2]
+    assert lines[2] == []
+    for level in (0.25, 0.5):
+        assert len(lines[level]) == 1
+        loop = lines[level][0]
+        assert loop[0] == loop[-1]
+        assert all(p.z == level for p in loop)
+        # counter-clockwise around the peak
+        area = sum(ccw(Vector3(0.05, -0.05, 0), a, b)
+                   for a, b in zip(loop, loop[1:]))
+        assert area > 0
+
+def test_contours_open():
+    g = flat_graph([(0.5, 0.3, 0), (-0.5, -0.3, 0)])
+    for v in g.vertices:
+        v.z = v.x
+    lines = contours(g, [0.0])[0.0]
+    assert len(lines) == 1
+    assert all(abs(p.x) < 1e-12 for p in lines[0])
+    assert lines[0][0].y == 1 and lines[0][-1].y == -1
+
+def test_graph_normals():
+    g = flat_graph([(0.05, -0.05, 1), (0.5, 0.3, 0), (-0.5, -0.3, 0)])
+    peak = g.vertices[4]
+    assert abs(g.normals[peak.id].z - 1) < 0.1
+    assert g.normals[0].z < 1
+    g.set_height(peak, 0)
+    assert all(n == Vector3(0, 0, 1) for n in g.normals)
+
+def test_graph_normals_incremental():
+    rand = Random(3)
+    g = flat_graph([(rand.uniform(-0.9, 0.9), rand.uniform(-0.9, 0.9),
+                     rand.random()) for i in range(50)])
+    g.set_height(g.vertices[20], 2)
+    normals = [n.copy() for n in g.normals]
+    g.update_normals(g.vertices)
+    for n, m in zip(g.normals, normals):
+        assert abs(n - m) < 1e-12
+    verts = g.gl_vertices(smooth=True)
+    assert len(verts) == len(g.gl_vertices())
+
+def test_convex_hull():
+    points = [Vertex(x, y, 0) for x, y in
+              [(0, 0), (2, 0), (1, 1), (4, 0), (4, 4), (0, 4), (3, 1), (0, 2)]]
+    hull = convex_hull(points)
+    assert [(p.x, p.y) for p in hull] == \
+        [(0, 0), (2, 0), (4, 0), (4, 4), (0, 4), (0, 2)]
+    assert len(convex_hull([Vertex(i, i, 0) for i in range(5)])) == 2
+
+def test_graph_points():
+    rand = Random(5)
+    points = [(rand.uniform(10, 20), rand.uniform(-5, 5), rand.random())
+              for i in range(200)]
+    points += [(10, -5, 0), (15, -5, 0), (20, -5, 0), (20, 5, 0), (10, 5, 0)]
+    points.append(points[0])
+    g = Graph(points)
+    assert len(g.vertices) == 205
+    assert len(g.hull) == 5
+    faces = list(g.faces())
+    assert len(faces) == 2 * len(g.vertices) - len(g.hull) - 2
+    for face in faces:
+        assert ccw(*[he.origin for he in face]) > 0
+    assert len(g.gl_vertices()) == (len(faces) + 2 * 5) * (3 * 3 * 3)
+
+def test_graph_points_grid():
+    # every interior point lands on an edge made before it
+    for k in (3, 5, 10):
+        g = Graph([(x, y, 0) for x in range(k) for y in range(k)])
+        faces = list(g.faces())
+        assert len(g.hull) == 4 * (k - 1)
+        assert len(faces) == 2 * k * k - len(g.hull) - 2
+        for face in faces:
+            assert ccw(*[he.origin for he in face]) > 0
+
+def test_graph_add_vertex_on_edge():
+    g = flat_graph([])
+    g.add_vertex(Vertex(0.5, 0.5, 0))
+    assert len(list(g.faces())) == 4
+    assert all(len(v.halfedges) == 3 for v in (g.vertices[0], g.vertices[2]))
+    assert len(g.vertices[4].halfedges) == 4
+    with pytest.raises(ValueError):
+        g.add_vertex(Vertex(0.5, 0.5, 1))
+    with pytest.raises(ValueError):
+        g.add_vertex(Vertex(1, 0, 0))
+    assert len(g.vertices) == 5 and len(list(g.faces())) == 4
+
+def test_graph_add_vertex_outside():
+    rand = Random(2)
+    g = Graph([(rand.uniform(10, 20), rand.uniform(-5, 5), 0)
+               for i in range(50)])
+    for x, y in [(25, 0), (0, 0), (15, 9), (15, -9)]:
+        with pytest.raises(ValueError):
+            g.add_vertex(Vertex(x, y, 0))
+    with pytest.raises(ValueError):
+        g.locate(Vertex(25, 0, 0), g.hull[0].halfedges[0])
+    assert len(g.vertices) == 50
+    g.add_vertex(Vertex(15, 0, 0))
+    assert len(list(g.faces())) == 2 * 51 - len(g.hull) - 2
+
+def test_graph_points_colinear():
+    with pytest.raises(ValueError):
+        Graph([(0, 0, 0), (1, 1, 0), (2, 2, 0)])
+
+def test_convex_ears():
+    square = [Vertex(x, y, 0) for x, y in
+              [(0, 0), (1, 0), (2, 0), (2, 1), (2, 2), (1, 2), (0, 2), (0, 1)]]
+    ears = convex_ears(square)
+    assert len(ears) == 6
+    assert all(ccw(*ear) > 0 for ear in ears)
+
+def test_vertex_ids():
+    g = flat_graph([(0.4, 0.3, 0), (-0.5, 0.2, 0)])
+    assert [v.id for v in g.vertices] == list(range(6))
+    index = dict((v, i) for i, v in enumerate(g.vertices))
+    assert all(index[v] == v.id for v in g.vertices)
+    assert g.vertices[4] != g.vertices[5]
+    assert g.vertices[4] == g.vertices[4]
+    v = Vertex(0.4, 0.3, 0)
+    assert v != g.vertices[4]
+    assert v in set([v])
+    # the same id in another graph is a different vertex
+    h = flat_graph([(-0.2, 0.6, 0), (0.1, -0.7, 0)])
+    assert g.vertices[5] != h.vertices[5] and h.vertices[5] not in g.vertices
+    assert dict([(g.vertices[5], 1)]).get(h.vertices[5]) is None
+    w = Vertex(0.2, -0.4, 0)
+    key = hash(w)
+    g.add_vertex(w)
+    assert hash(w) == key and w.id == 6
+
+def test_euclid_slots():
+    for obj in (Vector3(), Point3(), Matrix4(),
+                LineSegment3(Point3(0, 0, 0), Point3(1, 1, 1))):
+        assert not hasattr(obj, '__dict__')
+    assert hasattr(Vertex(0, 0, 0), '__dict__')
+
+def test_euclid_pickle():
+    import pickle
+    p = pickle.loads(pickle.dumps(Point3(1, 2, 3)))
+    assert type(p) is Point3 and p == Point3(1, 2, 3)
+    m = pickle.loads(pickle.dumps(Matrix4.new_translate(1, 2, 3)))
+    assert m[:] == Matrix4.new_translate(1, 2, 3)[:]
+    v = Vertex(1, 2, 3)
+    v.id = 7
+    v = pickle.loads(pickle.dumps(v))
+    assert (v.x, v.y, v.z, v.id, v.halfedges) == (1, 2, 3, 7, [])
+
+def test_euclid_operators():
+    v, p = Vector3(1, 2, 3), Point3(4, 5, 6)
+    assert type(v + v) is Vector3 and type(p + p) is Vector3
+    assert type(v + p) is Point3 and type(p + v) is Point3
+    assert type(Vertex(0, 0, 0) + v) is Point3
+    assert type(p - p) is Vector3 and p - p == Vector3(0, 0, 0)
+    assert v * 2 == 2 * v == Vector3(2, 4, 6) and type(v * 2.0) is Vector3
+    assert type(v * p) is Point3 and v * p == Point3(4, 10, 18)
+    assert v / 2 == Vector3(0.5, 1, 1.5) and -v == Vector3(-1, -2, -3)
+    assert v + (1, 1, 1) == Vector3(2, 3, 4)
+    assert v.cross(p) == Vector3(-3, 6, -3)
+    assert v.xy == (1, 2) and v.zzx == (3, 3, 1) and getattr(v, '') == ()
+    # numpy scalars are scalars, 3-element arrays are vectors
+    import numpy as np
+    for s in (np.float64(2), np.int64(2)):
+        assert type(v * s) is Vector3 and v * s == s * v == Vector3(2, 4, 6)
+    assert type(v / np.float64(2)) is Vector3
+    assert v + np.ones(3) == np.ones(3) + v == Vector3(2, 3, 4)
+    assert np.ones(3) - v == Vector3(0, -1, -2)
+    with pytest.raises(TypeError):
+        v + np.float64(1)
+    with pytest.raises(AttributeError):
+        v.__array_interface__
+    with pytest.raises(AttributeError):
+        v.xw
+
+def test_vector3_array():
+    vs = [Vector3(1, 2, 3), Vector3(0, 0, 0), Vector3(-1, 0.5, 2)]
+    ps = [Point3(4, 5, 6), Point3(1, 0, 0), Point3(0, 1, 0)]
+    a, b = Vector3Array.from_vectors(vs), Point3Array.from_vectors(ps)
+    assert len(a) == 3 and a[0] == Vector3(1, 2, 3) and type(b[1]) is Point3
+    assert (a + b).to_vectors() == [v + p for v, p in zip(vs, ps)]
+    assert type(a + b) is Point3Array and type(a + a) is Vector3Array
+    assert type(b - b) is Vector3Array
+    assert (a - Vector3(1, 1, 1)).to_vectors() == [v - Vector3(1, 1, 1) for v in vs]
+    assert (a * 2).to_vectors() == [v * 2 for v in vs]
+    assert list(a.dot(b)) == [v.dot(p) for v, p in zip(vs, ps)]
+    assert a.cross(b).to_vectors() == [v.cross(p) for v, p in zip(vs, ps)]
+    for n, v in zip(a.normalized(), vs):
+        assert abs(n - v.normalized()) < 1e-12
+    assert list(a.magnitude()) == pytest.approx([abs(v) for v in vs])
+    # vector operands apply per component to every row, from either side
+    m = Vector3Array([(1, 2, 3), (4, 5, 6), (7, 8, 9)])
+    assert (m * Vector3(1, 0, 2)).data.tolist() == \
+        [[1, 0, 6], [4, 0, 12], [7, 0, 18]]
+    assert (Vector3(1, 0, 2) * m) == m * (1, 0, 2)
+    assert type(m * Point3(1, 1, 1)) is Point3Array
+    assert (m * [1, 0, 2]).data.tolist() == [[1, 2, 3], [0, 0, 0], [14, 16, 18]]
+    assert (a[:2] * Vector3(2, 2, 2)).to_vectors() == [v * 2 for v in vs[:2]]
+    s = Vector3(1, 1, 1) + b
+    assert type(s) is Point3Array and s.to_vectors() == [
+        Vector3(1, 1, 1) + p for p in ps]
+    d = Point3(1, 2, 3) - b
+    assert type(d) is Vector3Array and d.to_vectors() == [
+        Point3(1, 2, 3) - p for p in ps]
+    assert (b - Point3(1, 2, 3)) == -d
+    assert (1, 1, 1) - Vector3(1, 2, 3) == Vector3(0, -1, -2)
+
+    a.normalize()
+    assert a[1] == Vector3(0, 0, 0)
+    assert list(a.magnitude()) == pytest.approx([1, 0, 1])
+
+def test_gl_vertices():
+    rand = Random(8)
+    g = Graph([(rand.random(), rand.random(), rand.random())
+               for i in range(40)])
+    faces = list(g.faces())
+    flat, smooth = g.gl_vertices(), g.gl_vertices(smooth=True)
+    assert len(flat) == len(smooth) == (len(faces) + 2 * len(g.hull)) * 27
+    for i, face in enumerate(faces):
+        a, b, c = [he.origin for he in face]
+        normal = (a - c).cross(b - a).normalize()
+        for j, v in enumerate((a, b, c)):
+            row = 9 * (3 * i + j)
+            assert flat[row:row + 3] == [v.x, v.y, v.z]
+            assert abs(Vector3(*flat[row + 3:row + 6]) - normal) < 1e-12
+            assert smooth[row + 3:row + 6] == list(g.normals[v.id])
+            assert flat[row + 6:row + 9] == [0.4] * 3
+
+def test_matrix4_transform_many():
+    rand = Random(3)
+    points = [Point3(rand.uniform(-5, 5), rand.uniform(-5, 5),
+                     rand.uniform(-20, -1)) for _ in range(20)]
+    for m in (Matrix4.new_translate(1, 2, 3).rotatez(0.4).scale(2, 1, 3),
+              Matrix4.new_perspective(1.2, 1.5, 0.1, 100.0)):
+        result = m.transform_many([p[:] for p in points])
+        assert result.shape == (20, 3)
+        for row, p in zip(result, points):
+            assert abs(Point3(*row) - m.transform(p)) < 1e-9
+        array = m.transform_many(Point3Array.from_vectors(points))
+        assert type(array) is Point3Array and (array.data == result).all()
+
+def test_matrix4_in_place():
+    m = Matrix4.new_translate(1, 2, 3).rotatez(0.7).scale(2, 3, 4)
+    assert Matrix4().set_trs(1, 2, 3, 0.7, 2, 3, 4)[:] == pytest.approx(m[:])
+    r = Matrix4.new_rotatex(0.3)
+    assert m.mul_into(r, Matrix4())[:] == pytest.approx((m * r)[:])
+    out = m.copy()
+    assert out.mul_into(r, out)[:] == pytest.approx((m * r)[:])
+    out = m.copy()
+    assert out.inverse_into(out)[:] == pytest.approx(m.inverse()[:])
+    assert Matrix4.new_scale(0, 1, 1).inverse_into(m.copy())[:] == Matrix4()[:]
+    buf = [0.0] * 16
+    assert m.elements_into(buf) == m[:]
+
+    pool = Matrix4Pool(1)
+    a = pool.get()
+    a.scale(2, 2, 2)
+    pool.release(a)
+    b = pool.get()
+    assert b is a and b[:] == Matrix4()[:]
+    assert pool.get() is not a
+
+def test_bench_run():
+    rows = bench.run([30], repeat=1)
+    assert [row[0] for row in rows] == ['insert', 'insert batch', 'delaunay',
+        'gl_vertices', 'gl_vertices smooth', 'matrix setup']
+    assert all(size == 30 and t >= 0 for _, size, t, _, _ in rows)
+    assert rows[0][4] > 0 and rows[3][4] is None
+    # 30 points in a split square give 62 triangles
+    assert rows[3][3] == 62 * 3 + 4 * 6
+
+def test_stats(tmpdir):
+    stats.count('ignored')
+    with stats.timer('ignored'):
+        pass
+    stats.frame()
+    assert stats.summary() == {}
+
+    stats.enable(window=2)
+    try:
+        graph = flat_graph([(0.3, 0.4, 0), (-0.5, 0.2, 0)])
+        stats.frame()
+        with stats.timer('work'):
+            graph.gl_vertices()
+        stats.count('walk_steps', 4)
+        stats.frame()
+        summary = stats.summary()
+        assert summary['vertices_added'] == {'mean': 1, 'max': 2, 'last': 0}
+        assert summary['walk_steps']['last'] == 4
+        assert summary['vertices_exported']['last'] == 6 * 3 + 4 * 6
+        assert summary['work']['last'] > 0
+        assert 'walk_steps' in stats.report()
+
+        path = str(tmpdir.join('stats.json'))
+        stats.dump(path)
+        import json
+        with open(path) as f:
+            assert len(json.load(f)['frames']) == 2
+    finally:
+        stats.disable()
+        stats.reset()
+
+def test_import_is_headless():
+    import subprocess, sys
+    code = ("import sys, terrain.__main__, terrain.geometry; "
+            "assert 'pyglet' not in sys.modules")
+    subprocess.check_call([sys.executable, '-c', code])
+
+def test_main_arguments(capsys):
+    from terrain.__main__ import main
+    # rejected before anything opens a window
+    for argv in (['--stats-dump'], ['--frames']):
+        with pytest.raises(SystemExit):
+            main(argv)
+    assert 'usage: python -m terrain' in capsys.readouterr().err
+
+def test_geometry_worker():
+    w = worker.GeometryWorker()
+    try:
+        ready = dict()
+        while len(ready) < 2:
+            ready.update(w.poll(10))
+        assert len(ready[0]) == len(ready[1]) == (2 * 3 + 4 * 6) * 9
+        w.add_vertex(0.4, 0.3, 0.5)
+        w.add_vertex(-0.5, 0.2, 0.5)
+        ready = dict()
+        while len(ready) < 2 or len(ready[0]) < (6 * 3 + 4 * 6) * 9:
+            ready.update(w.poll(10))
+        assert len(ready[1]) == (6 * 3 + 4 * 6) * 9
+        assert ready[0].typecode == 'f'
+
+        # failed edits are reported and the worker keeps going; a vertex
+        # outside the square used to keep it walking forever
+        w.add_vertex(1, 0, 0.5, index=0)
+        w.add_vertex(3, 0.2, 0.5, index=0)
+        w.add_vertex(0.1, -0.6, 0.5, index=0)
+        ready = dict()
+        while 0 not in ready:
+            ready.update(w.poll(10))
+        assert len(w.errors) == 2 and 'ValueError' in w.errors[0]
+        assert 'outside the hull' in w.errors[1]
+        assert len(ready[0]) == (8 * 3 + 4 * 6) * 9
+
+        # the last edit that worked is the one undone
+        w.undo()
+        ready = dict()
+        while 0 not in ready:
+            ready.update(w.poll(10))
+        assert len(ready[0]) == (6 * 3 + 4 * 6) * 9
+        w.redo()
+        ready = dict()
+        while 0 not in ready:
+            ready.update(w.poll(10))
+        assert len(ready[0]) == (8 * 3 + 4 * 6) * 9
+
+        w._process.terminate()
+        w._process.join(5)
+        with pytest.raises(worker.WorkerError):
+            w.poll(10)
+    finally:
+        w.close()
+
+def test_hilbert_sort():
+    assert [hilbert_index(x, y, 1) for x, y in [(0, 0), (0, 1), (1, 1), (1, 0)]] \
+        == [0, 1, 2, 3]
+    cells = sorted((hilbert_index(x, y, 3), x, y)
+                   for x in range(8) for y in range(8))
+    assert [d for d, _, _ in cells] == list(range(64))
+    # consecutive cells are neighbours
+    for (_, x0, y0), (_, x1, y1) in zip(cells, cells[1:]):
+        assert abs(x1 - x0) + abs(y1 - y0) == 1
+
+def test_graph_add_vertices():
+    rand = Random(5)
+    points = [Vertex(rand.uniform(-0.9, 0.9), rand.uniform(-0.9, 0.9), 0)
+              for i in range(300)]
+    assert sorted(map(id, brio_order(points, 1))) == sorted(map(id, points))
+    g = flat_graph([])
+    g.add_vertices(points)
+    assert len(list(g.faces())) == 2 + 2 * 300
+    single = flat_graph([(p.x, p.y, 0) for p in points])
+    assert g.walk_steps < single.walk_steps / 2
+
+def assert_delaunay(g):
+    for face in g.faces():
+        for he in face:
+            other = he.twin
+            if other.next.next.next != other or \
+                    ccw(*[h.origin for h in other.face()]) <= 0:
+                continue
+            a, b, c = [h.origin for h in face]
+            assert incircle(a, b, c, other.next.next.origin) <= 1e-12
+
+def test_delaunay():
+    rand = Random(4)
+    points = [(rand.random(), rand.random(), rand.random()) for i in range(500)]
+    g = delaunay(points + points[:10])
+    assert len(g.vertices) == 500
+    assert len(list(g.faces())) == 2 * 500 - 2 - len(g.hull)
+    assert_delaunay(g)
+    g.add_vertex(Vertex(0.5, 0.5, 0))
+    assert len(list(g.faces())) == 2 * 501 - 2 - len(g.hull)
+
+def test_delaunay_grid():
+    # colinear hull points, points on edges and cocircular quads
+    g = delaunay([(x, y, 0) for x in range(6) for y in range(6)])
+    assert len(g.hull) == 20
+    assert len(list(g.faces())) == 2 * 5 * 5
+    assert_delaunay(g)
+    with pytest.raises(ValueError):
+        delaunay([(x, x, 0) for x in range(5)])
+
+    # a step floats can't represent, the rows are only almost straight
+    step = 2 * 0.95 / 19
+    points = [(-0.95 + step * (i % 20), -0.95 + step * (i // 20), 0)
+              for i in range(400)]
+    Random(2).shuffle(points)
+    for g in (delaunay(points), flat_graph(points)):
+        validate.check(g)
+        for face in g.faces():
+            assert ccw(*[he.origin for he in face]) > 0
+    assert_delaunay(delaunay(points))
+
+def test_voronoi():
+    import numpy as np
+    rand = Random(6)
+    g = delaunay([(rand.random(), rand.random(), 0) for i in range(300)])
+    cells = voronoi(g)
+    assert len(cells) == 300
+    hull = np.array([(v.x, v.y) for v in g.hull])
+    x, y = hull.T
+    area = (x * np.roll(y, -1) - np.roll(x, -1) * y).sum() / 2
+    assert (cells.areas() > 0).all()
+    assert cells.areas().sum() == pytest.approx(area)
+    sites = np.array([(v.x, v.y) for v in g.vertices])
+    for i in range(len(cells)):
+        # cells are convex, so this point is inside and nearest to site i
+        inside = (cells.cell(i).mean(axis=0) + sites[i]) / 2
+        assert ((sites - inside) ** 2).sum(axis=1).argmin() == i
+
+    grid = voronoi(delaunay([(x, y, 0) for x in range(3) for y in range(3)]))
+    assert list(grid.areas()) == [0.25, 0.5, 0.25, 0.5, 1, 0.5, 0.25, 0.5, 0.25]
+
+def test_vertex_pool():
+    rand = Random(9)
+    pool = VertexPool((rand.uniform(-1, 1), rand.uniform(-1, 1), rand.random())
+                      for i in range(100))
+    assert len(pool) == 100 and pool.add(0.1, 0.2, 0.3) == 100
+    assert pool[100] == (0.1, 0.2, 0.3)
+    g = Graph(pool.vertices())
+    d = delaunay(pool.vertices())
+    assert len(g.vertices) == len(d.vertices) == 101
+    assert len(list(g.faces())) == len(list(d.faces()))
+    plain = Graph([pool[key] for key in range(len(pool))])
+    assert len(list(plain.faces())) == len(list(g.faces()))
+
+    # one position, separate topology
+    u = next(v for v in g.vertices if v.key == 100)
+    w = next(v for v in d.vertices if v.key == 100)
+    assert u is not w and u.halfedges is not w.halfedges
+    g.set_height(u, 2)
+    assert w.z == 2 and pool.zs[100] == 2
+    assert type(u.copy()) is Vertex and u.copy() == Point3(0.1, 0.2, 2)
+    # only the graph the height was set through updates its normals
+    assert g.normals[u.id] == u.normal() and d.normals[w.id] != w.normal()
+
+    # the worker's graphs share a pool and keep each other's normals up
+    # to date
+    scene = worker._Graphs(*worker.default_graphs())
+    key = scene.pool.add(0.2, 0.3, 0.5)
+    assert scene.add_vertex(0, key) == (0,) and scene.add_vertex(1, key) == (1,)
+    for graph in scene.graphs:
+        validate.check(graph)
+        assert [v.key for v in graph.vertices] == [0, 1, 2, 3, 4]
+    assert scene.graphs[0].vertices[0].z == scene.graphs[1].vertices[0].z
+    assert scene.set_height(0, 4, 1.5) == [0, 1]
+    for graph in scene.graphs:
+        assert graph.vertices[4].z == 1.5
+        assert graph.normals == [v.normal() for v in graph.vertices]
+
+def test_journal():
+    def state(g):
+        faces = set(tuple(he.origin.id for he in face) for face in g.faces())
+        rings = [[he.twin.origin.id for he in v.halfedges] for v in g.vertices]
+        links = all(he.prev.twin is v.halfedges[i - 1] and he.twin.twin is he
+                    for v in g.vertices for i, he in enumerate(v.halfedges))
+        return (faces, rings, links, [v.z for v in g.vertices],
+                [n[:] for n in g.normals])
+
+    rand = Random(4)
+    g = Graph([(rand.uniform(-1, 1), rand.uniform(-1, 1), rand.random())
+               for i in range(30)])
+    journal = Journal(g)
+    start = state(g)
+    base = journal.snapshot()
+    assert not journal.undo()
+
+    g.add_vertex(Vertex(0.05, 0.02, 0.5))
+    one = state(g)
+    mark = journal.snapshot()
+    g.add_vertices([Vertex(rand.uniform(-0.5, 0.5), rand.uniform(-0.5, 0.5),
+                           rand.random()) for i in range(10)])
+    g.set_height(g.vertices[3], 2)
+    end = state(g)
+    assert len(journal.done) == 4
+
+    assert journal.undo() and journal.undo() and state(g) == one
+    assert journal.undo() and state(g) == start and len(g.vertices) == 30
+    assert journal.redo() and state(g) == one
+    journal.restore(base)
+    assert state(g) == start
+    journal.restore(journal.undone[0])
+    assert state(g) == end
+
+    # editing after undo drops what could have been redone
+    journal.restore(mark)
+    dropped = journal.undone[0]
+    g.add_vertex(Vertex(-0.3, 0.1, 0))
+    assert not journal.can_redo()
+    with pytest.raises(ValueError):
+        journal.restore(dropped)
+    journal.restore(base)
+    assert state(g) == start
+    journal.close()
+    g.add_vertex(Vertex(0.1, 0.1, 0))
+    assert g.journal is None and not journal.can_redo()
+
+    # an insertion that splits an edge
+    g = flat_graph([])
+    journal = Journal(g)
+    start = state(g)
+    g.add_vertex(Vertex(0.5, 0.5, 0))
+    split = state(g)
+    assert journal.undo() and state(g) == start
+    assert journal.redo() and state(g) == split
+
+    # the worker undoes a command in every graph it changed, and rolls
+    # back an edit that fails part way
+    scene = worker._Graphs(*worker.default_graphs())
+    starts = [state(graph) for graph in scene.graphs]
+    assert scene.apply('add_vertex', None, (0.2, 0.3, 0.5)) == ({0, 1}, [])
+    added = [state(graph) for graph in scene.graphs]
+    assert scene.apply('set_height', 0, (4, 1.5)) == ({0, 1}, [])
+    raised = [state(graph) for graph in scene.graphs]
+    assert scene.apply('undo', None, ()) == ([0, 1], [])
+    assert [state(graph) for graph in scene.graphs] == added
+    assert scene.apply('undo', None, ()) == ([0, 1], [])
+    assert [state(graph) for graph in scene.graphs] == starts
+    assert scene.apply('undo', None, ()) == ((), [])
+    scene.apply('redo', None, ())
+    scene.apply('redo', None, ())
+    assert [state(graph) for graph in scene.graphs] == raised
+    for graph in scene.graphs:
+        validate.check(graph)
+
+    def fail(vertices):
+        raise ValueError('fails after the height is set')
+    scene.graphs[0].update_normals = fail
+    changed, errors = scene.apply('set_height', 0, (4, 0.25))
+    assert not changed and 'fails after' in errors[0]
+    del scene.graphs[0].update_normals
+    assert [state(graph) for graph in scene.graphs] == raised
+    assert scene.apply('undo', None, ()) == ([0, 1], [])
+    assert [state(graph) for graph in scene.graphs] == added
+
+def test_validate():
+    import numpy as np
+    rand = Random(6)
+    points = [(rand.uniform(-1, 1), rand.uniform(-1, 1), rand.random())
+              for i in range(200)]
+    for g in (Graph(points), delaunay(points), flat_graph([(0.4, 0.3, 0)])):
+        assert validate.problems(g) == []
+        validate.check(g)
+    t = validate.export(g)
+    assert len(t.twin) == 2 * (3 * 5 - 3 - 4) and t.positions.shape == (5, 2)
+    assert (t.twin[t.twin] == np.arange(len(t.twin))).all()
+
+    g = Graph(points)
+    v = g.vertices[50]
+    a, b = v.halfedges[0], v.halfedges[1]
+    a.next, b.next = b.next, a.next
+    assert validate.problems(g)
+    with pytest.raises(ValueError):
+        validate.check(g)
+    with pytest.raises(ValueError):
+        validate.check_sample(g, [a.next.origin])
+    a.next, b.next = b.next, a.next
+    validate.check_sample(g, g.vertices)
+
+    validate.enable(8, seed=1)
+    try:
+        g.add_vertices([Vertex(rand.uniform(-0.5, 0.5),
+                               rand.uniform(-0.5, 0.5), 0) for i in range(50)])
+        v.halfedges.reverse()
+        with pytest.raises(ValueError):
+            g.add_vertex(Vertex(v.x + 1e-3, v.y + 1e-3, 0))
+    finally:
+        validate.disable()